@@ -0,0 +1,188 @@
+# SPDX-License-Identifier: MIT
+
+# Copyright (c) 2021-2024 scmanjarrez. All rights reserved.
+# This work is licensed under the terms of the MIT license.
+
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import database as db
+import metrics
+
+
+# one worker keeps a single connection and runs statements in order
+_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="database")
+
+
+def _timed(func: Callable, *args: Any) -> Any:
+    with metrics.DATABASE_SECONDS.time(func.__name__):
+        return func(*args)
+
+
+async def run(func: Callable, *args: Any) -> Any:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_EXECUTOR, _timed, func, *args)
+
+
+def defer(func: Callable, *args: Any) -> asyncio.Future:
+    # fire and forget writes, still ordered with the awaited ones
+    future = asyncio.get_running_loop().run_in_executor(
+        _EXECUTOR, _timed, func, *args
+    )
+    future.add_done_callback(functools.partial(_check, func))
+    return future
+
+
+def _check(func: Callable, future: asyncio.Future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        logging.error(f"Database {func.__name__}: {future.exception()!r}")
+
+
+def shutdown() -> None:
+    _EXECUTOR.shutdown(wait=True)
+
+
+async def add_users(uids: List[str]) -> None:
+    await run(db.add_users, uids)
+
+
+async def user_settings(uid: str) -> db.User:
+    user = db.peek(uid)
+    if user is None:
+        user = await run(db.user_settings, uid)
+    return user
+
+
+async def resin(uid: str) -> int:
+    return (await user_settings(uid)).resin
+
+
+async def set_resin(uid: str, value: int) -> None:
+    await run(db.set_resin, uid, value)
+
+
+async def resin_warn(uid: str) -> int:
+    return (await user_settings(uid)).resin_warn
+
+
+async def toggle_resin_warn(uid: str) -> None:
+    await run(db.toggle_resin_warn, uid)
+
+
+async def teapot(uid: str) -> int:
+    return (await user_settings(uid)).teapot
+
+
+async def set_teapot(uid: str, value: int) -> None:
+    await run(db.set_teapot, uid, value)
+
+
+async def teapot_max(uid: str) -> int:
+    return (await user_settings(uid)).teapot_max
+
+
+async def set_teapot_max(uid: str, value: int) -> None:
+    await run(db.set_teapot_max, uid, value)
+
+
+async def set_teapot_max_many(values: List[Tuple[str, int]]) -> None:
+    await run(db.set_teapot_max_many, values)
+
+
+async def teapot_warn(uid: str) -> int:
+    return (await user_settings(uid)).teapot_warn
+
+
+async def toggle_teapot_warn(uid: str) -> None:
+    await run(db.toggle_teapot_warn, uid)
+
+
+async def parametric_warn(uid: str) -> int:
+    return (await user_settings(uid)).parametric_warn
+
+
+async def toggle_parametric_warn(uid: str) -> None:
+    await run(db.toggle_parametric_warn, uid)
+
+
+async def expedition_warn(uid: str) -> int:
+    return (await user_settings(uid)).expedition_warn
+
+
+async def toggle_expedition_warn(uid: str) -> None:
+    await run(db.toggle_expedition_warn, uid)
+
+
+async def updates(uid: str) -> int:
+    return (await user_settings(uid)).updates
+
+
+async def set_updates(uid: str, value: int) -> None:
+    await run(db.set_updates, uid, value)
+
+
+async def adaptive(uid: str) -> int:
+    return (await user_settings(uid)).adaptive
+
+
+async def set_adaptive(uid: str, value: int) -> None:
+    await run(db.set_adaptive, uid, value)
+
+
+async def updates_min(uid: str) -> int:
+    return (await user_settings(uid)).updates_min
+
+
+async def set_updates_min(uid: str, value: int) -> None:
+    await run(db.set_updates_min, uid, value)
+
+
+async def diary(
+    uid: str, year: int, month: int
+) -> Optional[Tuple[str, int, float]]:
+    return await run(db.diary, uid, year, month)
+
+
+async def set_diary(
+    uid: str, year: int, month: int, data: str, final: int, updated: float
+) -> None:
+    await run(db.set_diary, uid, year, month, data, final, updated)
+
+
+async def schedules() -> List[Tuple[str, str, float, int, int]]:
+    return await run(db.schedules)
+
+
+async def set_schedule(
+    uid: str, kind: str, due: float, chat: int, message: int
+) -> None:
+    await run(db.set_schedule, uid, kind, due, chat, message)
+
+
+async def del_schedule(uid: str, kind: str) -> None:
+    await run(db.del_schedule, uid, kind)
+
+
+async def del_schedules(keys: List[Tuple[str, str]]) -> None:
+    await run(db.del_schedules, keys)
+
+
+async def checkins(day: str) -> Dict[str, Tuple[str, int]]:
+    return await run(db.checkins, day)
+
+
+async def set_checkin(
+    uid: str, day: str, status: str, attempts: int, reward: str, updated: float
+) -> None:
+    await run(db.set_checkin, uid, day, status, attempts, reward, updated)
+
+
+async def cookie_renewals() -> Dict[str, float]:
+    return await run(db.cookie_renewals)
+
+
+async def set_cookie_renewed(uid: str, renewed: float) -> None:
+    await run(db.set_cookie_renewed, uid, renewed)
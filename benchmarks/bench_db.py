@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+
+# SPDX-License-Identifier: MIT
+
+# Copyright (c) 2021-2024 scmanjarrez. All rights reserved.
+# This work is licensed under the terms of the MIT license.
+
+# Time every database.py function on temporary databases of several sizes.
+# Usage: ./benchmarks/bench_db.py [-u 10000,100000] [-n ops] [-t threads]
+# Results are printed as JSON, one record per (users, workload, cache).
+
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import database as db  # noqa: E402
+
+
+DAY = "2024-01-01"
+GETTERS = (
+    "cached",
+    "user_settings",
+    "resin",
+    "resin_warn",
+    "teapot",
+    "teapot_max",
+    "teapot_warn",
+    "parametric_warn",
+    "expedition_warn",
+    "updates",
+    "adaptive",
+    "updates_min",
+)
+SETTERS = (
+    "set_resin",
+    "set_teapot",
+    "set_teapot_max",
+    "set_updates",
+    "set_adaptive",
+    "set_updates_min",
+)
+TOGGLES = (
+    "toggle_resin_warn",
+    "toggle_teapot_warn",
+    "toggle_parametric_warn",
+    "toggle_expedition_warn",
+)
+# full table reads, timed with fewer calls
+SCANS = ("checkins", "schedules")
+SCAN_OPS = 50
+Call = Callable[[str], Any]
+
+
+def calls() -> Dict[str, Call]:
+    # every case takes one uid, batch functions get a one element batch
+    cases: Dict[str, Call] = {name: getattr(db, name) for name in GETTERS}
+    cases.update(
+        {
+            name: (lambda uid, fn=getattr(db, name): fn(uid, 1))
+            for name in SETTERS
+        }
+    )
+    cases.update({name: getattr(db, name) for name in TOGGLES})
+    cases.update(
+        {
+            "add_user": db.add_user,
+            "add_users": lambda uid: db.add_users([uid]),
+            "set_teapot_max_many": lambda uid: db.set_teapot_max_many(
+                [(uid, 1)]
+            ),
+            "diary": lambda uid: db.diary(uid, 2024, 1),
+            "set_diary": lambda uid: db.set_diary(
+                uid, 2024, 1, "{}", 1, time.time()
+            ),
+            "set_schedule": lambda uid: db.set_schedule(
+                uid, "notify_resin", time.time(), 1, 1
+            ),
+            "del_schedule": lambda uid: db.del_schedule(uid, "notify_resin"),
+            "checkins": lambda uid: db.checkins(DAY),
+            "set_checkin": lambda uid: db.set_checkin(
+                uid, DAY, "claimed", 1, "", time.time()
+            ),
+            "schedules": lambda uid: db.schedules(),
+        }
+    )
+    return cases
+
+
+def summary(samples: List[float], elapsed: float) -> Dict[str, float]:
+    samples = sorted(samples)
+    count = len(samples)
+    return {
+        "ops": count,
+        "ops_per_sec": round(count / elapsed, 1) if elapsed else 0.0,
+        "mean_us": round(sum(samples) / count * 1e6, 2),
+        "p50_us": round(samples[count // 2] * 1e6, 2),
+        "p99_us": round(samples[min(count - 1, count * 99 // 100)] * 1e6, 2),
+        "max_us": round(samples[-1] * 1e6, 2),
+    }
+
+
+def measure(call: Call, uids: List[str]) -> Dict[str, float]:
+    samples = []
+    start = time.perf_counter()
+    for uid in uids:
+        before = time.perf_counter()
+        call(uid)
+        samples.append(time.perf_counter() - before)
+    return summary(samples, time.perf_counter() - start)
+
+
+def fill(users: int) -> List[str]:
+    uids = [str(100000000 + idx) for idx in range(users)]
+    db.setup_db()
+    db.add_users(uids)
+    # a realistic share of rows in the secondary tables
+    for uid in uids[: users // 10]:
+        db.set_schedule(uid, "autoupdate_notes", time.time(), int(uid), 1)
+        db.set_checkin(uid, DAY, "claimed", 1, "", time.time())
+    return uids
+
+
+def single(
+    users: int, uids: List[str], ops: int, rng: random.Random
+) -> List[Dict[str, Any]]:
+    results = []
+    for name, call in calls().items():
+        if name in ("add_user", "add_users"):
+            # inserts need uids that are not in the table yet
+            sample = [f"new-{name}-{idx}" for idx in range(2 * ops)]
+            runs = (("cold", sample[:ops]), ("warm", sample[ops:]))
+        else:
+            count = min(ops, SCAN_OPS) if name in SCANS else ops
+            sample = rng.sample(uids, min(count, len(uids)))
+            runs = (("cold", sample), ("warm", sample))
+        for cache, batch in runs:
+            if cache == "cold":
+                # no cached users, connections and prepared statements
+                db.close_db()
+            stats = measure(call, batch)
+            results.append(
+                {"users": users, "workload": name, "cache": cache, **stats}
+            )
+    return results
+
+
+def mixed(
+    users: int,
+    uids: List[str],
+    ops: int,
+    threads: int,
+    reads: float,
+    seed: int,
+) -> Dict[str, Any]:
+    cases = calls()
+    writes = SETTERS + TOGGLES
+    samples: Dict[str, List[float]] = {"read": [], "write": []}
+    errors: Dict[str, int] = {}
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(idx: int) -> None:
+        rng = random.Random(seed + idx)
+        local: Dict[str, List[float]] = {"read": [], "write": []}
+        barrier.wait()
+        for _ in range(ops):
+            kind = "read" if rng.random() < reads else "write"
+            name = rng.choice(GETTERS if kind == "read" else writes)
+            before = time.perf_counter()
+            try:
+                cases[name](rng.choice(uids))
+            except sqlite3.Error as exc:
+                with lock:
+                    errors[type(exc).__name__] = (
+                        errors.get(type(exc).__name__, 0) + 1
+                    )
+                continue
+            local[kind].append(time.perf_counter() - before)
+        with lock:
+            for kind, values in local.items():
+                samples[kind].extend(values)
+
+    db.close_db()
+    pool = [
+        threading.Thread(target=worker, args=(idx,)) for idx in range(threads)
+    ]
+    for thread in pool:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    db.close_db()
+    total = samples["read"] + samples["write"]
+    return {
+        "users": users,
+        "workload": "mixed",
+        "cache": "cold",
+        "threads": threads,
+        "read_ratio": reads,
+        **summary(total, elapsed),
+        **{
+            f"{kind}_{key}": value
+            for kind, values in samples.items()
+            if values
+            for key, value in summary(values, elapsed).items()
+            if key in ("ops", "p50_us", "p99_us")
+        },
+        "errors": errors,
+    }
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    results = []
+    for users in args.users:
+        with tempfile.TemporaryDirectory() as folder:
+            db.close_db()
+            db.DB = os.path.join(folder, "paimon.db")
+            start = time.perf_counter()
+            uids = fill(users)
+            fill_seconds = time.perf_counter() - start
+            results.append(
+                {
+                    "users": users,
+                    "workload": "fill",
+                    "cache": "cold",
+                    "ops": users,
+                    "seconds": round(fill_seconds, 3),
+                    "db_bytes": sum(
+                        os.path.getsize(os.path.join(folder, name))
+                        for name in os.listdir(folder)
+                    ),
+                }
+            )
+            results.extend(single(users, uids, args.ops, rng))
+            for threads in args.threads:
+                results.append(
+                    mixed(
+                        users, uids, args.ops, threads, args.reads, args.seed
+                    )
+                )
+            db.close_db()
+    return {
+        "label": args.label,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "pragmas": list(db.PRAGMAS),
+        "ops": args.ops,
+        "seed": args.seed,
+        "results": results,
+    }
+
+
+def numbers(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark database.py on temporary databases."
+    )
+    parser.add_argument("-u", "--users", type=numbers, default=[10000, 100000])
+    parser.add_argument(
+        "-n",
+        "--ops",
+        type=int,
+        default=2000,
+        help="calls per workload, per thread in the mixed one",
+    )
+    parser.add_argument(
+        "-t",
+        "--threads",
+        type=numbers,
+        default=[1, 4],
+        help="thread counts of the mixed workload",
+    )
+    parser.add_argument(
+        "-r",
+        "--reads",
+        type=float,
+        default=0.9,
+        help="share of reads in the mixed workload",
+    )
+    parser.add_argument("-s", "--seed", type=int, default=0)
+    parser.add_argument(
+        "-l", "--label", default="", help="tag to tell strategies apart"
+    )
+    parser.add_argument("-o", "--output", help="write JSON here")
+    args = parser.parse_args()
+    report = json.dumps(run(args), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,551 @@
+#!/usr/bin/env python3
+
+# SPDX-License-Identifier: MIT
+
+# Copyright (c) 2021-2024 scmanjarrez. All rights reserved.
+# This work is licensed under the terms of the MIT license.
+
+# Drive the bot handlers against local HoYoLab and Bot API stand-ins.
+# Usage: ./benchmarks/bench_load.py [-a accounts] [-r rounds] [-c concurrency]
+
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Any, Dict, List
+
+import genshin
+import yarl
+from aiohttp import web
+from genshin.client import routes
+from genshin.models.model import APIModel
+from telegram import Update
+from telegram.ext import ApplicationBuilder
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import aiodb as adb  # noqa: E402
+import paimon  # noqa: E402
+import utils as ut  # noqa: E402
+
+
+HOST = "127.0.0.1"
+TOKEN = "123456:LOAD"
+BOT_ID = 123456
+CHAT = 100000000
+GAME_UID = 700000000
+LANG = "en-us"
+ICONS = "https://upload-os-bbs.mihoyo.com"
+CHARACTERS = ((10000002, "Ayaka"), (10000003, "Jean"), (10000016, "Diluc"))
+# callback data a user walks through after /menu
+SESSION = (
+    "notes_menu",
+    "notes_update",
+    "abyss_seasons_menu",
+    "abyss_floors_menu:current",
+    "abyss_menu:current:all",
+    "abyss_menu:current:12",
+    "abyss_menu:previous:all",
+    "diary_month_menu",
+    f"diary_menu:{datetime.datetime.now().month}",
+    "main_menu",
+)
+NOTIFIERS = ("update_notes", "notify_resin", "notify_teapot")
+
+
+def localized(data: Any) -> Any:
+    # nested genshin.py models look their language up in the payload
+    if isinstance(data, dict):
+        return {"lang": LANG, **{k: localized(v) for k, v in data.items()}}
+    if isinstance(data, list):
+        return [localized(item) for item in data]
+    return data
+
+
+def ok(data: Any) -> web.Response:
+    return web.json_response(
+        {"retcode": 0, "message": "OK", "data": localized(data)}
+    )
+
+
+def side_icon(idx: int) -> str:
+    name = CHARACTERS[idx % len(CHARACTERS)][1]
+    return f"{ICONS}/genshin/UI_AvatarIcon_Side_{name}.png"
+
+
+def fake_notes(uid: int) -> Dict[str, Any]:
+    resin = uid % 160
+    return {
+        "current_resin": resin,
+        "max_resin": 160,
+        "resin_recovery_time": str((160 - resin) * 8 * 60),
+        "current_home_coin": uid % 2400,
+        "max_home_coin": 2400,
+        "home_coin_recovery_time": str(uid % 86400),
+        "finished_task_num": uid % 5,
+        "total_task_num": 4,
+        "is_extra_task_reward_received": False,
+        "remain_resin_discount_num": 3,
+        "resin_discount_num_limit": 3,
+        "transformer": {
+            "obtained": True,
+            "recovery_time": {
+                "Day": 2,
+                "Hour": 0,
+                "Minute": 0,
+                "Second": 0,
+                "reached": False,
+            },
+        },
+        "expeditions": [
+            {
+                "avatar_side_icon": {"icon": side_icon(idx)},
+                "status": "Ongoing" if idx % 2 else "Finished",
+                "remained_time": str(idx * 3600),
+            }
+            for idx in range(5)
+        ],
+        "max_expedition_num": 5,
+    }
+
+
+def fake_abyss() -> Dict[str, Any]:
+    now = int(time.time())
+    avatars = [
+        {
+            "id": cid,
+            "name": name,
+            "element": "Cryo",
+            "rarity": 5,
+            "icon": "https://example.com/icon.png",
+            "level": 90,
+        }
+        for cid, name in CHARACTERS
+    ]
+    ranks = [
+        {
+            "avatar_id": cid,
+            "avatar_icon": "https://example.com/icon.png",
+            "value": idx * 7,
+            "rarity": 5,
+        }
+        for idx, (cid, _) in enumerate(CHARACTERS)
+    ]
+    floors = [
+        {
+            "index": fl,
+            "icon": "",
+            "is_unlock": True,
+            "settle_time": str(now),
+            "star": 9,
+            "max_star": 9,
+            "levels": [
+                {
+                    "index": ch,
+                    "star": 3,
+                    "max_star": 3,
+                    "battles": [
+                        {
+                            "index": half,
+                            "timestamp": str(now),
+                            "avatars": avatars,
+                        }
+                        for half in (1, 2)
+                    ],
+                }
+                for ch in (1, 2, 3)
+            ],
+        }
+        for fl in range(9, 13)
+    ]
+    return {
+        "schedule_id": 1,
+        "start_time": str(now - 86400),
+        "end_time": str(now + 86400),
+        "total_battle_times": 24,
+        "total_win_times": 12,
+        "max_floor": "12-3",
+        "total_star": 36,
+        "is_unlock": True,
+        "reveal_rank": ranks,
+        "defeat_rank": ranks,
+        "damage_rank": ranks,
+        "take_damage_rank": ranks,
+        "normal_skill_rank": ranks,
+        "energy_skill_rank": ranks,
+        "floors": floors,
+    }
+
+
+def fake_diary(uid: int, month: int) -> Dict[str, Any]:
+    return {
+        "uid": uid,
+        "region": "os_euro",
+        "nickname": "Traveler",
+        "data_month": month,
+        "month_data": {
+            "current_primogems": 1600,
+            "current_mora": 100000,
+            "last_primogems": 1200,
+            "last_mora": 90000,
+            "primogem_rate": 33,
+            "mora_rate": 11,
+            "group_by": [
+                {"action_id": idx, "action": action, "num": 800, "percent": 50}
+                for idx, action in enumerate(("Events", "Quests"))
+            ],
+        },
+        "day_data": {"current_primogems": 60, "current_mora": 5000},
+    }
+
+
+class HoYoLab:
+    # genshin.Client routes are rewritten to http://host:port/<host>/<path>
+    def __init__(self) -> None:
+        self.calls: Counter = Counter()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        path = request.match_info["tail"]
+        self.calls[path.rsplit("/", 1)[-1]] += 1
+        uid = int(request.query.get("role_id", GAME_UID))
+        if path.endswith("/dailyNote"):
+            return ok(fake_notes(uid))
+        if path.endswith("/spiralAbyss"):
+            return ok(fake_abyss())
+        if path.endswith("/month_info"):
+            return ok(fake_diary(uid, int(request.query.get("month", 1))))
+        if path.endswith("/getUserGameRolesByCookie"):
+            ltuid = int(request.cookies.get("ltuid", CHAT))
+            return ok(
+                {
+                    "list": [
+                        {
+                            "game_biz": "hk4e_global",
+                            "region": "os_euro",
+                            "region_name": "Europe Server",
+                            "game_uid": str(ltuid - CHAT + GAME_UID),
+                            "nickname": "Traveler",
+                            "level": 60,
+                            "is_chosen": True,
+                            "is_official": True,
+                        }
+                    ]
+                }
+            )
+        self.calls["unknown"] += 1
+        logging.warning(f"HoYoLab stand-in: unknown path {path}")
+        return web.json_response({"retcode": -1, "message": "unknown"})
+
+
+class BotAPI:
+    def __init__(self) -> None:
+        self.calls: Counter = Counter()
+        self.ids = itertools.count(1000)
+
+    def message(self, chat: int, text: str = "") -> Dict[str, Any]:
+        return {
+            "message_id": next(self.ids),
+            "date": int(time.time()),
+            "chat": {"id": chat, "type": "private"},
+            "from": {"id": BOT_ID, "is_bot": True, "first_name": "Paimon"},
+            "text": text,
+        }
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        if method == "getMe":
+            result: Any = {
+                "id": BOT_ID,
+                "is_bot": True,
+                "first_name": "Paimon",
+                "username": "paimon_bot",
+            }
+        elif method in ("sendMessage", "sendDocument", "editMessageText"):
+            result = self.message(
+                int(params.get("chat_id", CHAT)), params.get("text", "")
+            )
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+
+def reroute(base: str) -> None:
+    def local(url: yarl.URL) -> yarl.URL:
+        return yarl.URL(f"{base}/{url.host}{url.path}").with_query(url.query)
+
+    for route in vars(routes).values():
+        if isinstance(route, routes.Route):
+            route.url = local(route.url)
+        elif isinstance(route, routes.InternationalRoute):
+            route.urls = {
+                region: local(url) if url else url
+                for region, url in route.urls.items()
+            }
+        elif isinstance(route, routes.GameRoute):
+            route.urls = {
+                region: {
+                    game: local(url) if url else url
+                    for game, url in urls.items()
+                }
+                for region, urls in route.urls.items()
+            }
+
+
+def offline_genshin() -> None:
+    # static data genshin.py would otherwise download on first use
+    APIModel._mi18n["bbs"] = {}
+    for cid, name in CHARACTERS:
+        genshin.utility.extdb.update_character_name(
+            LANG, cid, name, name, "Cryo", 5
+        )
+
+
+def write_config(accounts: int, limits: bool) -> None:
+    settings: Dict[str, Any] = {
+        "token": TOKEN,
+        "webhook": False,
+        "log_level": "WARNING",
+        "timezone": "Europe/Madrid",
+    }
+    if not limits:
+        settings.update(
+            api_rate=1e6,
+            api_burst=1000000,
+            account_rate=1e6,
+            account_burst=1000000,
+            telegram_rate=1e6,
+            telegram_chat_interval=0,
+        )
+    config = {
+        "settings": settings,
+        "accounts": {
+            str(CHAT + idx): {
+                "ltoken": f"ltoken{idx}",
+                "ltuid": CHAT + idx,
+                "ctoken": f"ctoken{idx}",
+                "uid": GAME_UID + idx,
+                "stoken": "",
+            }
+            for idx in range(accounts)
+        },
+    }
+    with open(ut.CONF_FILE, "w") as f:
+        json.dump(config, f)
+
+
+def command(bot: Any, chat: int, text: str, ids: itertools.count) -> Update:
+    return Update.de_json(
+        {
+            "update_id": next(ids),
+            "message": {
+                "message_id": next(ids),
+                "date": int(time.time()),
+                "chat": {"id": chat, "type": "private"},
+                "from": {"id": chat, "is_bot": False, "first_name": "User"},
+                "text": text,
+                "entities": [
+                    {"type": "bot_command", "offset": 0, "length": len(text)}
+                ],
+            },
+        },
+        bot,
+    )
+
+
+def button(
+    bot: Any, chat: int, message: int, data: str, ids: itertools.count
+) -> Update:
+    return Update.de_json(
+        {
+            "update_id": next(ids),
+            "callback_query": {
+                "id": str(next(ids)),
+                "chat_instance": str(chat),
+                "data": data,
+                "from": {"id": chat, "is_bot": False, "first_name": "User"},
+                "message": {
+                    "message_id": message,
+                    "date": int(time.time()),
+                    "chat": {"id": chat, "type": "private"},
+                    "from": {
+                        "id": BOT_ID,
+                        "is_bot": True,
+                        "first_name": "Paimon",
+                    },
+                    "text": "menu",
+                },
+            },
+        },
+        bot,
+    )
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    hoyolab, botapi = HoYoLab(), BotAPI()
+    server = web.Application()
+    server.router.add_route("*", "/hoyolab/{tail:.*}", hoyolab.handle)
+    server.router.add_route("*", "/bot{token}/{method}", botapi.handle)
+    runner = web.AppRunner(server, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, HOST, 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    reroute(f"http://{HOST}:{port}/hoyolab")
+    offline_genshin()
+
+    ut.set_up()
+    application = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .base_url(f"http://{HOST}:{port}/bot")
+        .build()
+    )
+    paimon.setup_handlers(application)
+    errors: Counter = Counter()
+
+    async def failed(update: object, context: ut.Context) -> None:
+        errors[type(context.error).__name__] += 1
+
+    application.add_error_handler(failed)
+    await application.initialize()
+    await ut.post_init(application)
+    bot = application.bot
+
+    ids = itertools.count(1)
+    latencies: Dict[str, List[float]] = {}
+    limit = asyncio.Semaphore(args.concurrency)
+
+    async def timed(kind: str, call: Any) -> None:
+        async with limit:
+            start = time.perf_counter()
+            try:
+                await call
+            except Exception as exc:
+                errors[type(exc).__name__] += 1
+            latencies.setdefault(kind, []).append(time.perf_counter() - start)
+
+    async def session(chat: int) -> None:
+        # buttons only need some message id, the stand-in accepts any
+        await timed(
+            "/menu",
+            application.process_update(command(bot, chat, "/menu", ids)),
+        )
+        message = next(botapi.ids)
+        for data in SESSION:
+            await timed(
+                data.split(":")[0],
+                application.process_update(
+                    button(bot, chat, message, data, ids)
+                ),
+            )
+        target = ut.Target(chat, message)
+        for name in NOTIFIERS:
+            await timed(name, getattr(ut, name)(target))
+
+    chats = [int(uid) for uid in ut.accounts()]
+    start = time.perf_counter()
+    for _ in range(args.rounds):
+        await asyncio.gather(*(session(chat) for chat in chats))
+    handled = time.perf_counter() - start
+    while len(ut.OUTBOX):
+        await asyncio.sleep(0.01)
+    drained = time.perf_counter() - start
+
+    await ut.SCHEDULER.stop()
+    await application.shutdown()
+    await runner.cleanup()
+    adb.shutdown()
+
+    updates = sum(len(values) for values in latencies.values())
+    return {
+        "accounts": args.accounts,
+        "rounds": args.rounds,
+        "concurrency": args.concurrency,
+        "updates": updates,
+        "seconds": round(handled, 3),
+        "drained_seconds": round(drained, 3),
+        "updates_per_second": round(updates / handled, 1),
+        "latency_ms": {
+            kind: {
+                "count": len(values),
+                "p50": round(percentile(values, 50) * 1000, 2),
+                "p99": round(percentile(values, 99) * 1000, 2),
+            }
+            for kind, values in sorted(latencies.items())
+        },
+        "errors": dict(errors),
+        "hoyolab_calls": dict(hoyolab.calls),
+        "telegram_calls": dict(botapi.calls),
+    }
+
+
+def report(result: Dict[str, Any]) -> None:
+    print(
+        f"{result['updates']} updates from {result['accounts']} accounts in "
+        f"{result['seconds']}s ({result['updates_per_second']}/s), "
+        f"outbox drained after {result['drained_seconds']}s"
+    )
+    print(f"\n{'handler':<24}{'count':>8}{'p50 (ms)':>12}{'p99 (ms)':>12}")
+    for kind, stats in result["latency_ms"].items():
+        print(
+            f"{kind:<24}{stats['count']:>8}"
+            f"{stats['p50']:>12.2f}{stats['p99']:>12.2f}"
+        )
+    for title, calls in (
+        ("Errors", result["errors"]),
+        ("HoYoLab calls", result["hoyolab_calls"]),
+        ("Bot API calls", result["telegram_calls"]),
+    ):
+        if not calls:
+            continue
+        print(f"\n{title:<24}{'count':>8}")
+        for name, count in sorted(calls.items()):
+            print(f"{name:<24}{count:>8}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Offline end-to-end load benchmark."
+    )
+    parser.add_argument("-a", "--accounts", type=int, default=100)
+    parser.add_argument("-r", "--rounds", type=int, default=3)
+    parser.add_argument("-c", "--concurrency", type=int, default=64)
+    parser.add_argument(
+        "--limits",
+        action="store_true",
+        help="keep the default HoYoLab and Telegram rate limits",
+    )
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as folder:
+        os.chdir(folder)
+        write_config(args.accounts, args.limits)
+        result = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        report(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+
+# SPDX-License-Identifier: MIT
+
+# Copyright (c) 2021-2024 scmanjarrez. All rights reserved.
+# This work is licensed under the terms of the MIT license.
+
+# Compare render.py with the f-string formatters it replaced.
+# Usage: ./benchmarks/bench_render.py [iterations]
+
+import calendar
+import datetime
+import os
+import sys
+import timeit
+from types import SimpleNamespace as NS
+
+import pytz
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import render  # noqa: E402
+
+
+TZ = "Europe/Madrid"
+FLOORS = render.FLOORS
+CATEGORIES = [name for name, _ in render.STATS]
+
+
+class Ranks(NS):
+    def dict(self):
+        return {category: getattr(self, category) for category in CATEGORIES}
+
+
+def fake_notes() -> NS:
+    expeditions = [
+        NS(finished=idx % 2 == 0, remaining_time=datetime.timedelta(hours=idx))
+        for idx in range(5)
+    ]
+    return NS(
+        resin=120,
+        resin_max=160,
+        resin_time=datetime.timedelta(hours=5, minutes=20),
+        teapot=1500,
+        teapot_max=2400,
+        teapot_time=datetime.timedelta(hours=14),
+        parametric_time=datetime.timedelta(days=3),
+        commissions=4,
+        commissions_max=4,
+        commissions_claimed="Claimed",
+        weeklies=3,
+        weeklies_max=3,
+        expeditions=expeditions,
+    )
+
+
+def fake_abyss() -> NS:
+    chars = [NS(name=f"Character {idx}", value=idx * 7) for idx in range(4)]
+    ranks = Ranks(**{category: chars for category in CATEGORIES})
+    floors = [
+        NS(
+            floor=fl,
+            chambers=[
+                NS(
+                    chamber=ch,
+                    stars=3,
+                    max_stars=3,
+                    battles=[
+                        NS(characters=chars[: 2 + half]) for half in range(2)
+                    ],
+                )
+                for ch in range(1, 4)
+            ],
+        )
+        for fl in range(1, 13)
+    ]
+    return NS(
+        max_floor="12-3",
+        total_battles=24,
+        total_stars=36,
+        ranks=ranks,
+        floors=floors,
+    )
+
+
+def fake_diary() -> dict:
+    return {
+        "primogems": 8000,
+        "categories": [
+            ["Events", 4000, 50],
+            ["Daily Activity", 2000, 25],
+            ["Spiral Abyss", 2000, 25],
+        ],
+    }
+
+
+# formatters as they were in utils.py before render.py
+
+
+def legacy_last_updated() -> str:
+    return datetime.datetime.now(pytz.timezone(TZ)).strftime(
+        "%Y/%m/%d %H:%M:%S"
+    )
+
+
+def legacy_fmt_exp_chars(characters) -> str:
+    exp = [
+        f"    - Character {idx} => "
+        f"<code>"
+        f"{chr.remaining_time if not chr.finished else 'Finished'}"
+        f"</code>\n"
+        for idx, chr in enumerate(characters, 1)
+    ]
+    return "".join(exp)
+
+
+def legacy_notes(data) -> str:
+    return (
+        f"<b>Resin:</b> "
+        f"<code>"
+        f"{data.resin}/{data.resin_max} ({data.resin_time})"
+        f"</code>\n"
+        f"<b>Teapot Currency:</b> "
+        f"<code>"
+        f"{data.teapot}/{data.teapot_max} ({data.teapot_time})"
+        f"</code>\n"
+        f"<b>Parametric Transformer:</b> "
+        f"<code>"
+        f"{data.parametric_time}"
+        f"</code>\n"
+        f"<b>Commissions:</b> "
+        f"<code>"
+        f"{data.commissions}/{data.commissions_max} "
+        f"({data.commissions_claimed})"
+        f"</code>\n"
+        f"<b>Weekly Boss Discounts:</b> "
+        f"<code>"
+        f"{data.weeklies}/{data.weeklies_max}"
+        f"</code>\n"
+        f"<b>Expeditions:</b>\n"
+        f"{legacy_fmt_exp_chars(data.expeditions)}\n"
+        f"<b>Last updated</b>: <code>{legacy_last_updated()}</code>"
+    )
+
+
+def legacy_diary(month: int, data: dict) -> str:
+    msg = [
+        f"<b>Primogems earned in {calendar.month_name[month]}</b>: "
+        f"<code>{data['primogems']}</code>"
+    ]
+    for name, amount, percentage in data["categories"]:
+        msg.append(f"    - {name}: <code>{amount} ({percentage} %)</code>")
+    return "\n".join(msg)
+
+
+def legacy_abyss(data, previous: bool, floor: str) -> str:
+    sea = "Current"
+    if previous:
+        sea = "Previous"
+    return (
+        f"⚜ <b>{sea} Season</b> ⚜\n\n"
+        f"<b>Summary</b>:\n"
+        f"    - <b>Deepest Descent:</b> "
+        f"<code>"
+        f"{data.max_floor}"
+        f"</code>\n"
+        f"    - <b>Battles Fought:</b> "
+        f"<code>"
+        f"{data.total_battles} ({data.total_stars} ⭐️)"
+        f"</code>\n\n"
+        f"{legacy_fmt_stats(data.ranks)}"
+        f"{legacy_fmt_floors(data.floors, floor)}"
+    )
+
+
+def legacy_floor(floors, floor: str):
+    if floor in FLOORS:
+        return [fl for fl in floors if str(fl.floor) == floor]
+    else:
+        return [fl for fl in floors if str(fl.floor) in FLOORS]
+
+
+def legacy_fmt_floors(floors, floor: str) -> str:
+    data = legacy_floor(floors, floor)
+    msg = ""
+    parsed = "\n".join(
+        [
+            "".join(
+                [
+                    (
+                        f"    - <b>{fl.floor} - {ch.chamber}</b>: "
+                        f"{ch.stars}/{ch.max_stars} ⭐️\n"
+                        f"{legacy_fmt_battle_chars(ch.battles)}\n"
+                    )
+                    for ch in fl.chambers
+                ]
+            )
+            for fl in data
+        ]
+    )
+    if parsed:
+        msg = f"<b>Floors:</b>\n{parsed}"
+    return msg
+
+
+def legacy_fmt_battle_chars(battles) -> str:
+    msg = []
+    for battle in battles:
+        half = [char.name for char in battle.characters]
+        msg.append(f"    » <code>{', '.join(half)}</code>")
+    return "\n".join(msg)
+
+
+def legacy_fmt_stats(stats) -> str:
+    chars = sum([len(getattr(stats, category)) for category in stats.dict()])
+    msg = ""
+    if chars:
+        msg = (
+            f"<b>Stats</b>:\n"
+            f"    - <b>Most played</b>:\n"
+            f"{legacy_fmt_stat_chars(stats.most_played)}\n"
+            f"    - <b>Most kills</b>:\n"
+            f"{legacy_fmt_stat_chars(stats.most_kills)}\n"
+            f"    - <b>Strongest strike</b>:\n"
+            f"{legacy_fmt_stat_chars(stats.strongest_strike)}\n"
+            f"    - <b>Most damage taken</b>:\n"
+            f"{legacy_fmt_stat_chars(stats.most_damage_taken)}\n"
+            f"    - <b>Most bursts used</b>:\n"
+            f"{legacy_fmt_stat_chars(stats.most_bursts_used)}\n"
+            f"    - <b>Most skills used</b>:\n"
+            f"{legacy_fmt_stat_chars(stats.most_skills_used)}\n\n"
+        )
+    return msg
+
+
+def legacy_fmt_stat_chars(characters) -> str:
+    msg = []
+    for ch in characters:
+        msg.append(f"    » <code>{ch.name} ({ch.value})</code>")
+    return "\n".join(msg)
+
+
+def floor_switches(abyss_data):
+    # one fetch, then the user walks through every floor button
+    view = render.AbyssView(abyss_data, False)
+    return [view.render(floor) for floor in ("all", *FLOORS)]
+
+
+def legacy_floor_switches(abyss_data):
+    return [legacy_abyss(abyss_data, False, fl) for fl in ("all", *FLOORS)]
+
+
+def check(notes_data, abyss_data, diary_data) -> None:
+    strip = slice(None, -len("2024/01/01 00:00:00</code>"))
+    assert (
+        render.notes(notes_data, TZ)[strip] == legacy_notes(notes_data)[strip]
+    )
+    assert render.diary(5, diary_data) == legacy_diary(5, diary_data)
+    assert floor_switches(abyss_data) == legacy_floor_switches(abyss_data)
+
+
+def main() -> None:
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    notes_data, abyss_data, diary_data = (
+        fake_notes(),
+        fake_abyss(),
+        fake_diary(),
+    )
+    check(notes_data, abyss_data, diary_data)
+    cases = (
+        (
+            "notes",
+            lambda: legacy_notes(notes_data),
+            lambda: render.notes(notes_data, TZ),
+        ),
+        (
+            "diary",
+            lambda: legacy_diary(5, diary_data),
+            lambda: render.diary(5, diary_data),
+        ),
+        (
+            "abyss_floor_switches",
+            lambda: legacy_floor_switches(abyss_data),
+            lambda: floor_switches(abyss_data),
+        ),
+    )
+    print(f"{'case':<22}{'legacy (us)':>14}{'render (us)':>14}{'speedup':>10}")
+    for name, legacy, new in cases:
+        old_time = min(timeit.repeat(legacy, number=number, repeat=5))
+        new_time = min(timeit.repeat(new, number=number, repeat=5))
+        print(
+            f"{name:<22}"
+            f"{old_time / number * 1e6:>14.2f}"
+            f"{new_time / number * 1e6:>14.2f}"
+            f"{old_time / new_time:>9.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
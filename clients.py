@@ -0,0 +1,47 @@
+# SPDX-License-Identifier: MIT
+
+# Copyright (c) 2021-2024 scmanjarrez. All rights reserved.
+# This work is licensed under the terms of the MIT license.
+
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Tuple
+
+
+CAPACITY = 64
+IDLE = 30 * 60
+
+
+class ClientPool:
+    # clients are built on first use and kept in least recently used order,
+    # so idle ones always sit at the front
+    def __init__(
+        self,
+        factory: Callable[[str], Any],
+        capacity: int = CAPACITY,
+        idle: float = IDLE,
+    ) -> None:
+        self.factory = factory
+        self.capacity = capacity
+        self.idle = idle
+        self._clients: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, uid: str) -> Any:
+        now = time.monotonic()
+        entry = self._clients.pop(uid, None)
+        client = self.factory(uid) if entry is None else entry[1]
+        self._clients[uid] = (now, client)
+        self.evict(now)
+        return client
+
+    def drop(self, uid: str) -> None:
+        # next get builds a new client, e.g. after the cookies changed
+        self._clients.pop(uid, None)
+
+    def evict(self, now: float = None) -> None:
+        now = time.monotonic() if now is None else now
+        while self._clients:
+            used, _ = next(iter(self._clients.values()))
+            if len(self._clients) <= self.capacity and now - used < self.idle:
+                break
+            self._clients.popitem(last=False)
@@ -0,0 +1,185 @@
+# SPDX-License-Identifier: MIT
+
+# Copyright (c) 2021-2024 scmanjarrez. All rights reserved.
+# This work is licensed under the terms of the MIT license.
+
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import time
+import zlib
+from typing import Any, Callable, Dict, List, Optional
+
+import aiodb as adb
+import aiohttp
+import limiter
+
+
+RENEW_URL = (
+    "https://api-account-os.hoyolab.com/"
+    "account/auth/api/getCookieAccountInfoBySToken"
+)
+HEADERS = {
+    "x-rpc-app_version": "2.11.2",
+    "User-Agent": (
+        "Mozilla/5.0 (iPhone; CPU iPhone OS "
+        "13_2_3 like Mac OS X) AppleWebKit/"
+        "605.1.15 (KHTML, like Gecko) "
+        "miHoYoBBS/2.11.1"
+    ),
+    "x-rpc-client_type": "5",
+    "Referer": "https://webstatic.mihoyo.com/",
+    "Origin": "https://webstatic.mihoyo.com",
+}
+INTERVAL = 12 * 60 * 60
+TIMEOUT = 15
+CONNECTIONS = 4
+
+
+def merge(path: str, uid: str, account: Dict[str, Any]) -> None:
+    # sharded workers share the file, each only rewrites its own account
+    with open(f"{path}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        with open(path) as f:
+            config = json.load(f)
+        config["accounts"][uid] = account
+        save(path, json.dumps(config, indent=2))
+
+
+def save(path: str, text: str) -> None:
+    # readers never see a partially written config
+    folder = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=folder, prefix=".config.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class CookieService:
+    def __init__(
+        self,
+        path: str,
+        config: Dict[str, Any],
+        renewed: Callable[[str], None],
+        rate_limiter: limiter.RateLimiter,
+        interval: float = INTERVAL,
+    ) -> None:
+        self.path = path
+        self.config = config
+        self.renewed = renewed
+        self.limiter = rate_limiter
+        self.interval = interval
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._pending: Dict[str, asyncio.Future] = {}
+        # wall clock, renewal times are kept in the database across restarts
+        self._renewed: Dict[str, float] = {}
+        self._loaded = False
+        self._since = time.time()
+        self._save = asyncio.Lock()
+
+    def stoken(self, uid: str) -> Optional[str]:
+        return self.config["accounts"][uid].get("stoken") or None
+
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers=HEADERS,
+                connector=aiohttp.TCPConnector(limit=CONNECTIONS),
+                timeout=aiohttp.ClientTimeout(total=TIMEOUT),
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+
+    def last(self, uid: str) -> float:
+        if uid in self._renewed:
+            return self._renewed[uid]
+        # accounts never renewed are spread over one interval after startup
+        return self._since - zlib.crc32(uid.encode()) / 2**32 * self.interval
+
+    def due(self, uids: List[str] = None, now: float = None) -> List[str]:
+        now = time.time() if now is None else now
+        uids = self.config["accounts"] if uids is None else uids
+        return [
+            uid
+            for uid in uids
+            if self.stoken(uid) is not None
+            and now - self.last(uid) >= self.interval
+        ]
+
+    async def load(self) -> None:
+        if not self._loaded:
+            for uid, renewed in (await adb.cookie_renewals()).items():
+                self._renewed[uid] = max(self._renewed.get(uid, 0), renewed)
+            self._loaded = True
+
+    async def renew(self, uid: str) -> bool:
+        # concurrent InvalidCookies for one account share a single renewal
+        if uid not in self._pending:
+            task = asyncio.ensure_future(self._renew(uid))
+            self._pending[uid] = task
+            task.add_done_callback(lambda _: self._pending.pop(uid, None))
+        return await asyncio.shield(self._pending[uid])
+
+    async def _renew(self, uid: str) -> bool:
+        stoken = self.stoken(uid)
+        if stoken is None:
+            return False
+        ltuid = self.config["accounts"][uid]["ltuid"]
+        await self.limiter.acquire(uid)
+        try:
+            async with self.session().post(
+                RENEW_URL,
+                params={"uid": ltuid, "stoken": stoken},
+                headers={"Cookie": f"stuid={ltuid};stoken={stoken}"},
+            ) as res:
+                data = json.loads(await res.text())
+            cookie_token = data["data"]["cookie_token"]
+        except (
+            aiohttp.ClientError,
+            asyncio.TimeoutError,
+            ValueError,
+            KeyError,
+            TypeError,
+        ) as exc:
+            logging.warning(f"Could not renew cookie_token of {uid}: {exc!r}")
+            return False
+        self._renewed[uid] = time.time()
+        await adb.set_cookie_renewed(uid, self._renewed[uid])
+        if self.config["accounts"][uid].get("ctoken") != cookie_token:
+            self.config["accounts"][uid]["ctoken"] = cookie_token
+            self.renewed(uid)
+            await self.persist(uid)
+        return True
+
+    async def persist(self, uid: str) -> None:
+        # copy on the loop, write in a thread, one writer at a time
+        account = dict(self.config["accounts"][uid])
+        async with self._save:
+            await asyncio.get_running_loop().run_in_executor(
+                None, merge, self.path, uid, account
+            )
+
+    async def refresh(self, uids: List[str] = None) -> int:
+        await self.load()
+        uids = self.due(uids)
+        results = await asyncio.gather(
+            *(self.renew(uid) for uid in uids), return_exceptions=True
+        )
+        for uid, res in zip(uids, results):
+            if isinstance(res, Exception):
+                logging.error(
+                    f"Could not renew cookie_token of {uid}: {res!r}"
+                )
+        return sum(1 for res in results if res is True)
@@ -6,194 +6,404 @@
 # This work is licensed under the terms of the MIT license.
 
 import sqlite3 as sql
+import threading
 from contextlib import closing
+from typing import Dict, List, Optional, Tuple
 
 
 DB = "paimon.db"
+STMT_CACHE = 128
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -8000",
+)
+_LOCAL = threading.local()
+_POOL: List[sql.Connection] = []
+_POOL_LOCK = threading.Lock()
+# bumped by close_db, other threads notice their connection was closed
+_GENERATION = 0
+USER_COLUMNS = (
+    "uid",
+    "resin_warn",
+    "resin",
+    "teapot_warn",
+    "teapot",
+    "teapot_max",
+    "parametric_warn",
+    "expedition_warn",
+    "updates",
+    "adaptive",
+    "updates_min",
+)
+USER_MIGRATIONS = (
+    ("adaptive", "INTEGER DEFAULT -1"),
+    ("updates_min", "INTEGER DEFAULT 15"),
+)
+USER_QUERY = f"SELECT {', '.join(USER_COLUMNS)} FROM users WHERE uid = ?"
+_USERS: Dict[str, "User"] = {}
+_USERS_LOCK = threading.RLock()
+
+
+class User:
+    __slots__ = USER_COLUMNS
+
+    def __init__(self, row: tuple) -> None:
+        for column, value in zip(USER_COLUMNS, row):
+            setattr(self, column, value)
+
+
+def _connect() -> sql.Connection:
+    db = sql.connect(DB, cached_statements=STMT_CACHE, check_same_thread=False)
+    for pragma in PRAGMAS:
+        db.execute(pragma)
+    return db
+
+
+def connection() -> sql.Connection:
+    # one long-lived connection per thread, so sqlite3 statement cache
+    # keeps prepared statements across calls
+    conn = getattr(_LOCAL, "conn", None)
+    if conn is None or _LOCAL.path != DB or _LOCAL.generation != _GENERATION:
+        conn = _connect()
+        with _POOL_LOCK:
+            _POOL.append(conn)
+            _LOCAL.generation = _GENERATION
+        _LOCAL.conn = conn
+        _LOCAL.path = DB
+    return conn
+
+
+def close_db() -> None:
+    global _GENERATION
+    with _POOL_LOCK:
+        _GENERATION += 1
+        while _POOL:
+            _POOL.pop().close()
+    _LOCAL.__dict__.clear()
+    clear_cache()
+
+
+def clear_cache() -> None:
+    with _USERS_LOCK:
+        _USERS.clear()
 
 
 def setup_db() -> None:
-    with closing(sql.connect(DB)) as db:
-        with closing(db.cursor()) as cur:
-            cur.executescript(
-                """
-                CREATE TABLE IF NOT EXISTS users (
-                    uid TEXT PRIMARY KEY,
-                    resin_warn INTEGER DEFAULT 1,
-                    resin INTEGER DEFAULT 150,
-                    teapot_warn INTEGER DEFAULT 1,
-                    teapot INTEGER DEFAULT 2200,
-                    teapot_max INTEGER DEFAULT 0,
-                    parametric_warn INTEGER DEFAULT 1,
-                    expedition_warn INTEGER DEFAULT 1,
-                    updates INTEGER DEFAULT 240
-                );
-                """
-            )
+    db = connection()
+    with closing(db.cursor()) as cur:
+        cur.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                uid TEXT PRIMARY KEY,
+                resin_warn INTEGER DEFAULT 1,
+                resin INTEGER DEFAULT 150,
+                teapot_warn INTEGER DEFAULT 1,
+                teapot INTEGER DEFAULT 2200,
+                teapot_max INTEGER DEFAULT 0,
+                parametric_warn INTEGER DEFAULT 1,
+                expedition_warn INTEGER DEFAULT 1,
+                updates INTEGER DEFAULT 240,
+                adaptive INTEGER DEFAULT -1,
+                updates_min INTEGER DEFAULT 15
+            );
+
+            CREATE TABLE IF NOT EXISTS diary (
+                uid TEXT,
+                year INTEGER,
+                month INTEGER,
+                data TEXT,
+                final INTEGER DEFAULT 0,
+                updated REAL,
+                PRIMARY KEY (uid, year, month)
+            );
+
+            CREATE TABLE IF NOT EXISTS schedule (
+                uid TEXT,
+                kind TEXT,
+                due REAL,
+                chat INTEGER,
+                message INTEGER,
+                PRIMARY KEY (uid, kind)
+            );
+
+            CREATE TABLE IF NOT EXISTS checkin (
+                uid TEXT,
+                day TEXT,
+                status TEXT,
+                attempts INTEGER DEFAULT 0,
+                reward TEXT,
+                updated REAL,
+                PRIMARY KEY (uid, day)
+            );
+
+            CREATE TABLE IF NOT EXISTS cookie (
+                uid TEXT PRIMARY KEY,
+                renewed REAL
+            );
+            """
+        )
+        cur.execute("PRAGMA table_info(users)")
+        columns = {row[1] for row in cur.fetchall()}
+        for column, definition in USER_MIGRATIONS:
+            if column not in columns:
+                cur.execute(
+                    f"ALTER TABLE users ADD COLUMN {column} {definition}"
+                )
+        db.commit()
 
 
 def cached(uid: str) -> int:
-    with closing(sql.connect(DB)) as db:
-        with closing(db.cursor()) as cur:
-            cur.execute(
-                "SELECT EXISTS ("
-                "SELECT 1 "
-                "FROM users "
-                "WHERE uid = ?"
-                ")",
-                [uid],
-            )
-            return cur.fetchone()[0]
+    if uid in _USERS:
+        return 1
+    with closing(connection().cursor()) as cur:
+        cur.execute(
+            "SELECT EXISTS (SELECT 1 FROM users WHERE uid = ?)",
+            [uid],
+        )
+        return cur.fetchone()[0]
 
 
 def add_user(uid: str) -> None:
-    with closing(sql.connect(DB)) as db:
-        with closing(db.cursor()) as cur:
-            cur.execute("INSERT INTO users (uid) VALUES (?)", [uid])
-            db.commit()
+    db = connection()
+    with _USERS_LOCK, closing(db.cursor()) as cur:
+        cur.execute("INSERT INTO users (uid) VALUES (?)", [uid])
+        db.commit()
+        _USERS.pop(uid, None)
+
+
+def add_users(uids: List[str]) -> None:
+    db = connection()
+    with _USERS_LOCK, closing(db.cursor()) as cur:
+        cur.executemany(
+            "INSERT OR IGNORE INTO users (uid) VALUES (?)",
+            [(uid,) for uid in uids],
+        )
+        db.commit()
+
+
+def peek(uid: str) -> Optional[User]:
+    # cached settings only, never touches the database
+    return _USERS.get(uid)
+
+
+def user_settings(uid: str) -> User:
+    user = _USERS.get(uid)
+    if user is None:
+        with _USERS_LOCK, closing(connection().cursor()) as cur:
+            cur.execute(USER_QUERY, [uid])
+            user = _USERS[uid] = User(cur.fetchone())
+    return user
+
+
+def _set(uid: str, column: str, value: int) -> None:
+    db = connection()
+    with _USERS_LOCK, closing(db.cursor()) as cur:
+        cur.execute(
+            f"UPDATE users SET {column} = ? WHERE uid = ?", [value, uid]
+        )
+        db.commit()
+        if uid in _USERS:
+            setattr(_USERS[uid], column, value)
+
+
+def _toggle(uid: str, column: str) -> None:
+    db = connection()
+    with _USERS_LOCK, closing(db.cursor()) as cur:
+        cur.execute(
+            f"UPDATE users SET {column} = -{column} WHERE uid = ?", [uid]
+        )
+        db.commit()
+        if uid in _USERS:
+            user = _USERS[uid]
+            setattr(user, column, -getattr(user, column))
 
 
 def resin(uid: str) -> int:
-    with closing(sql.connect(DB)) as db:
-        with closing(db.cursor()) as cur:
-            cur.execute("SELECT resin FROM users WHERE uid = ?", [uid])
-            return cur.fetchone()[0]
+    return user_settings(uid).resin
 
 
 def set_resin(uid: str, value: int) -> None:
-    with closing(sql.connect(DB)) as db:
-        with closing(db.cursor()) as cur:
-            cur.execute(
-                "UPDATE users SET resin = ? WHERE uid = ?", [value, uid]
-            )
-            db.commit()
+    _set(uid, "resin", value)
 
 
 def resin_warn(uid: str) -> int:
-    with closing(sql.connect(DB)) as db:
-        with closing(db.cursor()) as cur:
-            cur.execute("SELECT resin_warn FROM users WHERE uid = ?", [uid])
-            return cur.fetchone()[0]
+    return user_settings(uid).resin_warn
 
 
 def toggle_resin_warn(uid: str) -> None:
-    with closing(sql.connect(DB)) as db:
-        with closing(db.cursor()) as cur:
-            cur.execute(
-                "UPDATE users "
-                "SET resin_warn = -resin_warn "
-                "WHERE uid = ?",
-                [uid],
-            )
-            db.commit()
+    _toggle(uid, "resin_warn")
 
 
 def teapot(uid: str) -> int:
-    with closing(sql.connect(DB)) as db:
-        with closing(db.cursor()) as cur:
-            cur.execute("SELECT teapot FROM users WHERE uid = ?", [uid])
-            return cur.fetchone()[0]
+    return user_settings(uid).teapot
 
 
 def set_teapot(uid: str, value: int) -> None:
-    with closing(sql.connect(DB)) as db:
-        with closing(db.cursor()) as cur:
-            cur.execute(
-                "UPDATE users SET teapot = ? WHERE uid = ?", [value, uid]
-            )
-            db.commit()
+    _set(uid, "teapot", value)
 
 
 def teapot_max(uid: str) -> int:
-    with closing(sql.connect(DB)) as db:
-        with closing(db.cursor()) as cur:
-            cur.execute("SELECT teapot_max FROM users WHERE uid = ?", [uid])
-            return cur.fetchone()[0]
+    return user_settings(uid).teapot_max
 
 
 def set_teapot_max(uid: str, value: int) -> None:
-    with closing(sql.connect(DB)) as db:
-        with closing(db.cursor()) as cur:
-            cur.execute(
-                "UPDATE users SET teapot_max = ? WHERE uid = ?",
-                [value, uid],
-            )
-            db.commit()
+    _set(uid, "teapot_max", value)
+
+
+def set_teapot_max_many(values: List[Tuple[str, int]]) -> None:
+    db = connection()
+    with _USERS_LOCK, closing(db.cursor()) as cur:
+        cur.executemany(
+            "UPDATE users SET teapot_max = ? WHERE uid = ?",
+            [(value, uid) for uid, value in values],
+        )
+        db.commit()
+        for uid, value in values:
+            if uid in _USERS:
+                _USERS[uid].teapot_max = value
 
 
 def teapot_warn(uid: str) -> int:
-    with closing(sql.connect(DB)) as db:
-        with closing(db.cursor()) as cur:
-            cur.execute("SELECT teapot_warn FROM users WHERE uid = ?", [uid])
-            return cur.fetchone()[0]
+    return user_settings(uid).teapot_warn
 
 
 def toggle_teapot_warn(uid: str) -> None:
-    with closing(sql.connect(DB)) as db:
-        with closing(db.cursor()) as cur:
-            cur.execute(
-                "UPDATE users "
-                "SET teapot_warn = -teapot_warn "
-                "WHERE uid = ?",
-                [uid],
-            )
-            db.commit()
+    _toggle(uid, "teapot_warn")
 
 
 def parametric_warn(uid: str) -> int:
-    with closing(sql.connect(DB)) as db:
-        with closing(db.cursor()) as cur:
-            cur.execute(
-                "SELECT parametric_warn FROM users WHERE uid = ?", [uid]
-            )
-            return cur.fetchone()[0]
+    return user_settings(uid).parametric_warn
 
 
 def toggle_parametric_warn(uid: str) -> None:
-    with closing(sql.connect(DB)) as db:
-        with closing(db.cursor()) as cur:
-            cur.execute(
-                "UPDATE users "
-                "SET parametric_warn = -parametric_warn "
-                "WHERE uid = ?",
-                [uid],
-            )
-            db.commit()
+    _toggle(uid, "parametric_warn")
 
 
 def expedition_warn(uid: str) -> int:
-    with closing(sql.connect(DB)) as db:
-        with closing(db.cursor()) as cur:
-            cur.execute(
-                "SELECT expedition_warn FROM users WHERE uid = ?", [uid]
-            )
-            return cur.fetchone()[0]
+    return user_settings(uid).expedition_warn
 
 
 def toggle_expedition_warn(uid: str) -> None:
-    with closing(sql.connect(DB)) as db:
-        with closing(db.cursor()) as cur:
-            cur.execute(
-                "UPDATE users "
-                "SET expedition_warn = -expedition_warn "
-                "WHERE uid = ?",
-                [uid],
-            )
-            db.commit()
+    _toggle(uid, "expedition_warn")
 
 
 def updates(uid: str) -> int:
-    with closing(sql.connect(DB)) as db:
-        with closing(db.cursor()) as cur:
-            cur.execute("SELECT updates FROM users WHERE uid = ?", [uid])
-            return cur.fetchone()[0]
+    return user_settings(uid).updates
 
 
 def set_updates(uid: str, value: int) -> None:
-    with closing(sql.connect(DB)) as db:
-        with closing(db.cursor()) as cur:
-            cur.execute(
-                "UPDATE users SET updates = ? WHERE uid = ?",
-                [value, uid],
-            )
-            db.commit()
+    _set(uid, "updates", value)
+
+
+def adaptive(uid: str) -> int:
+    return user_settings(uid).adaptive
+
+
+def set_adaptive(uid: str, value: int) -> None:
+    _set(uid, "adaptive", value)
+
+
+def updates_min(uid: str) -> int:
+    return user_settings(uid).updates_min
+
+
+def set_updates_min(uid: str, value: int) -> None:
+    _set(uid, "updates_min", value)
+
+
+def diary(uid: str, year: int, month: int) -> Optional[Tuple[str, int, float]]:
+    with closing(connection().cursor()) as cur:
+        cur.execute(
+            "SELECT data, final, updated FROM diary "
+            "WHERE uid = ? AND year = ? AND month = ?",
+            [uid, year, month],
+        )
+        return cur.fetchone()
+
+
+def set_diary(
+    uid: str, year: int, month: int, data: str, final: int, updated: float
+) -> None:
+    db = connection()
+    with closing(db.cursor()) as cur:
+        cur.execute(
+            "INSERT OR REPLACE INTO diary "
+            "(uid, year, month, data, final, updated) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [uid, year, month, data, final, updated],
+        )
+        db.commit()
+
+
+def schedules() -> List[Tuple[str, str, float, int, int]]:
+    with closing(connection().cursor()) as cur:
+        cur.execute("SELECT uid, kind, due, chat, message FROM schedule")
+        return cur.fetchall()
+
+
+def set_schedule(
+    uid: str, kind: str, due: float, chat: int, message: int
+) -> None:
+    db = connection()
+    with closing(db.cursor()) as cur:
+        cur.execute(
+            "INSERT OR REPLACE INTO schedule "
+            "(uid, kind, due, chat, message) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [uid, kind, due, chat, message],
+        )
+        db.commit()
+
+
+def del_schedule(uid: str, kind: str) -> None:
+    del_schedules([(uid, kind)])
+
+
+def del_schedules(keys: List[Tuple[str, str]]) -> None:
+    db = connection()
+    with closing(db.cursor()) as cur:
+        cur.executemany(
+            "DELETE FROM schedule WHERE uid = ? AND kind = ?", keys
+        )
+        db.commit()
+
+
+def checkins(day: str) -> Dict[str, Tuple[str, int]]:
+    with closing(connection().cursor()) as cur:
+        cur.execute(
+            "SELECT uid, status, attempts FROM checkin WHERE day = ?", [day]
+        )
+        return {uid: (status, attempts) for uid, status, attempts in cur}
+
+
+def set_checkin(
+    uid: str, day: str, status: str, attempts: int, reward: str, updated: float
+) -> None:
+    db = connection()
+    with closing(db.cursor()) as cur:
+        cur.execute(
+            "INSERT OR REPLACE INTO checkin "
+            "(uid, day, status, attempts, reward, updated) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [uid, day, status, attempts, reward, updated],
+        )
+        db.commit()
+
+
+def cookie_renewals() -> Dict[str, float]:
+    with closing(connection().cursor()) as cur:
+        cur.execute("SELECT uid, renewed FROM cookie")
+        return dict(cur.fetchall())
+
+
+def set_cookie_renewed(uid: str, renewed: float) -> None:
+    db = connection()
+    with closing(db.cursor()) as cur:
+        cur.execute(
+            "INSERT OR REPLACE INTO cookie (uid, renewed) VALUES (?, ?)",
+            [uid, renewed],
+        )
+        db.commit()
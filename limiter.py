@@ -0,0 +1,86 @@
+# SPDX-License-Identifier: MIT
+
+# Copyright (c) 2021-2024 scmanjarrez. All rights reserved.
+# This work is licensed under the terms of the MIT license.
+
+import asyncio
+import time
+from typing import Dict
+
+
+GLOBAL = "global"
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated", "queued", "waited")
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.queued = 0
+        self.waited = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(
+            self.tokens + (now - self.updated) * self.rate, self.burst
+        )
+        self.updated = now
+
+    def wait_time(self) -> float:
+        self._refill(time.monotonic())
+        return max(-self.tokens, 0) / self.rate
+
+    def reserve(self) -> float:
+        # tokens may go negative, the deficit is the queue ahead of us
+        self._refill(time.monotonic())
+        self.tokens -= 1
+        return max(-self.tokens, 0) / self.rate
+
+    async def acquire(self) -> float:
+        delay = self.reserve()
+        if delay:
+            self.queued += 1
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                self.queued -= 1
+        self.waited = delay
+        return delay
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        rate: float,
+        burst: int,
+        account_rate: float,
+        account_burst: int,
+    ) -> None:
+        self.account_rate = account_rate
+        self.account_burst = account_burst
+        self.buckets: Dict[str, TokenBucket] = {
+            GLOBAL: TokenBucket(rate, burst)
+        }
+
+    def bucket(self, uid: str) -> TokenBucket:
+        if uid not in self.buckets:
+            self.buckets[uid] = TokenBucket(
+                self.account_rate, self.account_burst
+            )
+        return self.buckets[uid]
+
+    async def acquire(self, uid: str) -> float:
+        waited = await self.bucket(uid).acquire()
+        return waited + await self.buckets[GLOBAL].acquire()
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {
+            key: {
+                "queued": bucket.queued,
+                "wait": bucket.wait_time(),
+                "last_wait": bucket.waited,
+            }
+            for key, bucket in self.buckets.items()
+        }
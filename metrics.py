@@ -0,0 +1,258 @@
+# SPDX-License-Identifier: MIT
+
+# Copyright (c) 2021-2024 scmanjarrez. All rights reserved.
+# This work is licensed under the terms of the MIT license.
+
+import bisect
+import contextlib
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Tuple
+
+from aiohttp import web
+
+
+HOST = "127.0.0.1"
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+CONTENT_TYPE = "text/plain; version=0.0.4"
+Labels = Tuple[str, ...]
+_METRICS: List["Metric"] = []
+
+
+def _labels(names: Labels, values: Labels, extra: str = "") -> str:
+    pairs = [
+        f'{name}="{str(value).replace(chr(34), chr(39))}"'
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, doc: str, labels: Labels = ()) -> None:
+        self.name = name
+        self.doc = doc
+        self.labels = labels
+        # observations also come from the database worker thread
+        self._lock = threading.Lock()
+        _METRICS.append(self)
+
+    def header(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.doc}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+
+    def expose(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, doc: str, labels: Labels = ()) -> None:
+        super().__init__(name, doc, labels)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, value: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def expose(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return self.header() + [
+            f"{self.name}{_labels(self.labels, key)} {value}"
+            for key, value in values
+        ]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        doc: str,
+        labels: Labels = (),
+        buckets: Tuple[float, ...] = BUCKETS,
+    ) -> None:
+        super().__init__(name, doc, labels)
+        self.buckets = buckets
+        # per label set: bucket counts (last one is +Inf), sum
+        self._values: Dict[Labels, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            if labels not in self._values:
+                self._values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+            counts, total = self._values[labels]
+            counts[idx] += 1
+            total[0] += value
+
+    @contextlib.contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def expose(self) -> List[str]:
+        with self._lock:
+            values = [
+                (key, list(counts), total[0])
+                for key, (counts, total) in self._values.items()
+            ]
+        lines = self.header()
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = _labels(self.labels, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {total}")
+            lines.append(
+                f"{self.name}_count{_labels(self.labels, key)} {cumulative}"
+            )
+        return lines
+
+
+class Gauge(Metric):
+    # sampled when scraped, the callback returns label values -> value
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        doc: str,
+        labels: Labels = (),
+        callback: Callable[[], Dict[Labels, float]] = None,
+    ) -> None:
+        super().__init__(name, doc, labels)
+        self.callback = callback
+
+    def expose(self) -> List[str]:
+        values = self.callback() if self.callback is not None else {}
+        return self.header() + [
+            f"{self.name}{_labels(self.labels, key)} {value}"
+            for key, value in values.items()
+        ]
+
+
+def expose() -> str:
+    lines = []
+    for metric in _METRICS:
+        lines.extend(metric.expose())
+    return "\n".join(lines) + "\n"
+
+
+async def _handler(request: web.Request) -> web.Response:
+    return web.Response(text=expose(), headers={"Content-Type": CONTENT_TYPE})
+
+
+async def serve(port: int, host: str = HOST) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get("/metrics", _handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+HOYOLAB_REQUESTS = Counter(
+    "paimon_hoyolab_requests_total",
+    "HoYoLab API calls by method and outcome.",
+    ("method", "outcome"),
+)
+HOYOLAB_SECONDS = Histogram(
+    "paimon_hoyolab_request_seconds",
+    "HoYoLab API call latency, without rate limiter waits.",
+    ("method",),
+)
+TELEGRAM_REQUESTS = Counter(
+    "paimon_telegram_requests_total",
+    "Bot API calls by method and outcome.",
+    ("method", "outcome"),
+)
+TELEGRAM_SECONDS = Histogram(
+    "paimon_telegram_request_seconds",
+    "Bot API call latency, without outbox waits.",
+    ("method",),
+)
+TELEGRAM_SKIPPED = Counter(
+    "paimon_telegram_edits_skipped_total",
+    "Message edits skipped because nothing changed.",
+)
+BUTTON_SECONDS = Histogram(
+    "paimon_button_handler_seconds",
+    "Callback query handling latency by menu route.",
+    ("route",),
+)
+DATABASE_SECONDS = Histogram(
+    "paimon_database_query_seconds",
+    "Database call latency on the database worker by function.",
+    ("query",),
+    (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1),
+)
+
+
+SCHEDULED = Gauge(
+    "paimon_scheduled_jobs",
+    "Pending scheduler events by kind.",
+    ("kind",),
+)
+JOB_QUEUE = Gauge(
+    "paimon_job_queue_jobs",
+    "Pending job queue jobs by name.",
+    ("name",),
+)
+OUTBOX_QUEUED = Gauge(
+    "paimon_outbox_queued",
+    "Bot API calls waiting in the outbox.",
+)
+LIMITER_QUEUED = Gauge(
+    "paimon_limiter_queued",
+    "HoYoLab calls waiting for a rate limiter token.",
+    ("bucket",),
+)
+LIMITER_WAIT = Gauge(
+    "paimon_limiter_wait_seconds",
+    "Seconds a new HoYoLab call would wait for a rate limiter token, "
+    "the longest of all accounts for the accounts bucket.",
+    ("bucket",),
+)
+LIMITER_LAST_WAIT = Gauge(
+    "paimon_limiter_last_wait_seconds",
+    "Seconds the last HoYoLab call waited for a rate limiter token, "
+    "the longest of all accounts for the accounts bucket.",
+    ("bucket",),
+)
+
+
+@contextlib.contextmanager
+def track(
+    requests: Counter, seconds: Histogram, method: str
+) -> Iterator[None]:
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException as exc:
+        outcome = type(exc).__name__
+        raise
+    finally:
+        seconds.observe(time.perf_counter() - start, method)
+        requests.inc(method, outcome)
+
+
+def hoyolab(method: str) -> contextlib.AbstractContextManager:
+    return track(HOYOLAB_REQUESTS, HOYOLAB_SECONDS, method)
+
+
+def telegram(method: str) -> contextlib.AbstractContextManager:
+    return track(TELEGRAM_REQUESTS, TELEGRAM_SECONDS, method)
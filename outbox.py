@@ -0,0 +1,92 @@
+# SPDX-License-Identifier: MIT
+
+# Copyright (c) 2021-2024 scmanjarrez. All rights reserved.
+# This work is licensed under the terms of the MIT license.
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Tuple
+
+import limiter
+from telegram.error import RetryAfter
+
+
+GLOBAL_RATE = 30
+CHAT_INTERVAL = 1.0
+RETRIES = 5
+Factory = Callable[[], Awaitable[Any]]
+
+
+class Outbox:
+    def __init__(
+        self,
+        rate: float = GLOBAL_RATE,
+        chat_interval: float = CHAT_INTERVAL,
+        retries: int = RETRIES,
+    ) -> None:
+        self.bucket = limiter.TokenBucket(rate, max(int(rate), 1))
+        self.chat_interval = chat_interval
+        self.retries = retries
+        self._queues: Dict[int, Deque[Tuple[Factory, asyncio.Future]]] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        self._paused = 0.0
+
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def submit(self, chat: int, factory: Factory) -> asyncio.Future:
+        # callers may await the future or just fire and forget
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queues.setdefault(chat, deque()).append((factory, future))
+        if chat not in self._workers:
+            self._workers[chat] = loop.create_task(self._worker(chat))
+        return future
+
+    async def _wait(self, last: float) -> None:
+        while True:
+            now = time.monotonic()
+            delay = max(last + self.chat_interval, self._paused) - now
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        await self.bucket.acquire()
+
+    async def _deliver(self, chat: int, factory: Factory, last: float) -> Any:
+        for _ in range(self.retries):
+            await self._wait(last)
+            try:
+                return await factory()
+            except RetryAfter as ra:
+                # flood control applies to the whole bot
+                self._paused = time.monotonic() + ra.retry_after
+            except Exception as exc:
+                logging.error(f"Could not deliver to {chat}: {exc!r}")
+                return None
+        logging.error(f"Flood control retries exhausted: {chat}")
+        return None
+
+    async def _worker(self, chat: int) -> None:
+        queue = self._queues[chat]
+        last = 0.0
+        try:
+            while True:
+                while queue:
+                    factory, future = queue[0]
+                    result = await self._deliver(chat, factory, last)
+                    last = time.monotonic()
+                    queue.popleft()
+                    if not future.done():
+                        future.set_result(result)
+                # linger for one interval, so a message submitted right
+                # after the queue drained still keeps its distance
+                delay = last + self.chat_interval - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if not queue:
+                    break
+        finally:
+            del self._queues[chat]
+            del self._workers[chat]
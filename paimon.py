@@ -5,14 +5,18 @@
 # Copyright (c) 2021-2024 scmanjarrez. All rights reserved.
 # This work is licensed under the terms of the MIT license.
 
+import asyncio
 import logging
 import os
+from typing import Any, Dict
 
 import paimon_cli as cli
 import paimon_gui as gui
+import shards
 import utils as ut
-from telegram import Update
+from telegram import Bot, Update
 from telegram.ext import (
+    Application,
     ApplicationBuilder,
     CallbackQueryHandler,
     CommandHandler,
@@ -22,30 +26,8 @@ from telegram.ext import (
 
 async def button_handler(update: Update, context: ut.Context):
     uid = ut.uid(update)
-    query = update.callback_query
     if cli.allowed(uid):
-        if query.data == "main_menu":
-            await gui.main_menu(update)
-        elif query.data == "notes_menu":
-            await gui.notes_menu(update, context)
-        elif query.data == "diary_month_menu":
-            await gui.diary_month_menu(update)
-        elif query.data.startswith("diary_menu"):
-            args = query.data.split("_")
-            await gui.diary_menu(update, int(args[-1]))
-        elif query.data == "abyss_seasons_menu":
-            await gui.abyss_seasons_menu(update)
-        elif query.data.startswith("abyss_floors_menu"):
-            args = query.data.split("_")
-            await gui.abyss_floors_menu(update, args[-1] == "previous")
-        elif query.data.startswith("abyss_menu"):
-            args = query.data.split("_")
-            await gui.abyss_menu(update, args[-2] == "previous", args[-1])
-        elif query.data == "notifications_menu":
-            await gui.notifications_menu(update)
-        elif query.data.startswith("notification_toggle"):
-            args = query.data.split("_")
-            await gui.notification_toggle(update, args[-1])
+        await gui.dispatch(update)
 
 
 def setup_handlers(application: ApplicationBuilder):
@@ -79,10 +61,15 @@ def setup_handlers(application: ApplicationBuilder):
     )
     application.add_handler(get_handler)
 
+    profile_handler = CommandHandler(
+        "profile", cli.profile, filters=~filters.UpdateType.EDITED_MESSAGE
+    )
+    application.add_handler(profile_handler)
+
     application.add_handler(CallbackQueryHandler(button_handler))
 
 
-if __name__ == "__main__":
+def setup_logging() -> None:
     logging.basicConfig(
         format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
         level=logging.INFO,
@@ -91,32 +78,112 @@ if __name__ == "__main__":
     logging.getLogger("apscheduler.scheduler").addFilter(ut.NoLog())
     logging.getLogger("httpx").addFilter(ut.NoLog())
 
-    if os.path.isfile(ut.CONF_FILE):
-        ut.set_up()
-        application = ApplicationBuilder().token(ut.setting("token")).build()
+
+def setup_jobs(application: Application):
+    application.job_queue.run_once(ut.update_db, 5, name="Starting DB update")
+    application.job_queue.run_repeating(
+        ut.refresh_cookies, ut.COOKIE_CHECK, first=30, name="cookies"
+    )
+    if ut.setting("checkin", True):
         application.job_queue.run_once(
-            ut.update_db, 5, name="Starting DB update"
+            ut.daily_checkin, 10, name="Starting daily claiming"
+        )
+
+
+def build_application(updater: bool = True) -> Application:
+    builder = (
+        ApplicationBuilder().token(ut.setting("token")).post_init(ut.post_init)
+    )
+    if not updater:
+        # shard workers get their updates from the front process
+        builder = builder.updater(None)
+    application = builder.build()
+    setup_jobs(application)
+    setup_handlers(application)
+    return application
+
+
+def webhook_url() -> str:
+    return f"https://{ut.setting('ip')}/{ut.setting('token')}"
+
+
+def update_key(data: Dict[str, Any]) -> str:
+    update = Update.de_json(data, None)
+    if update.effective_message is not None:
+        return ut.uid(update)
+    user = update.effective_user
+    return str(user.id if user is not None else update.update_id)
+
+
+def run_shard(shard: int, count: int) -> None:
+    setup_logging()
+    ut.set_up(shard, count)
+    port = ut.setting("shard_port", shards.PORT) + shard
+    asyncio.run(
+        shards.worker(
+            build_application(updater=False),
+            port,
+            post_shutdown=ut.post_shutdown,
         )
-        # application.job_queue.run_once(
-        #     ut.daily_checkin, 10, name="Starting daily claiming"
-        # )
-        setup_handlers(application)
+    )
 
+
+def run_single(webhook: bool) -> None:
+    application = build_application()
+    try:
+        if webhook:
+            application.run_webhook(
+                listen=ut.setting("listen"),
+                port=ut.setting("port"),
+                url_path=ut.setting("token"),
+                cert=ut.setting("cert"),
+                webhook_url=webhook_url(),
+                close_loop=False,
+            )
+        else:
+            application.run_polling(close_loop=False)
+    finally:
+        # this PTB version has no post_shutdown hook, run it on the loop
+        # the application ran on before closing it
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(ut.post_shutdown(application))
+        loop.close()
+
+
+def run_front(count: int) -> None:
+    forwarder = shards.Forwarder(
+        count, update_key, ut.setting("shard_port", shards.PORT)
+    )
+    asyncio.run(
+        shards.front(
+            Bot(ut.setting("token")),
+            forwarder,
+            shards.Workers(count, run_shard),
+            ut.setting("listen"),
+            ut.setting("port"),
+            ut.setting("token"),
+            webhook_url(),
+            ut.setting("cert", None),
+        )
+    )
+
+
+if __name__ == "__main__":
+    setup_logging()
+
+    if os.path.isfile(ut.CONF_FILE):
+        ut.set_up()
+        count = ut.setting("shards", 1)
         try:
-            if ut.setting("webhook"):
-                application.run_webhook(
-                    listen=ut.setting("listen"),
-                    port=ut.setting("port"),
-                    url_path=ut.setting("token"),
-                    cert=ut.setting("cert"),
-                    webhook_url=(
-                        f"https://"
-                        f"{ut.setting('ip')}/"
-                        f"{ut.setting('token')}"
-                    ),
+            if count > 1 and ut.setting("webhook"):
+                run_front(count)
+            elif count > 1:
+                logging.error(
+                    "Setting 'shards' requires 'webhook' to be true "
+                    f"in {ut.CONF_FILE}."
                 )
             else:
-                application.run_polling()
+                run_single(ut.setting("webhook"))
         except KeyError:
             logging.error(
                 f"New setting 'webhook' required "
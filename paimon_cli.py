@@ -3,9 +3,13 @@
 # Copyright (c) 2021-2024 scmanjarrez. All rights reserved.
 # This work is licensed under the terms of the MIT license.
 
-import database as db
+from typing import List
+
+import aiodb as adb
 
 import paimon_gui as gui
+import profiler
+import render
 import utils as ut
 from telegram import Update
 
@@ -15,14 +19,20 @@ HELP = (
     "\n\n"
     "❔ /menu - Interact with me using UI."
     "\n"
-    "❔ /redeem <code>code</code> - Redeem the gift code."
+    "❔ /redeem <code>code</code> [<code>code</code> ...] - Redeem the "
+    "gift codes. Admins can redeem them for every account with "
+    "/redeem all <code>code</code> [<code>code</code> ...]."
     "\n"
     "❔ /set <code>type</code> <code>value</code> - Set "
-    "<code>resin/teapot/updates</code> value. "
-    "Default resin: 150. Default teapot: 2200. Default updates (minutes): 240"
+    "<code>resin/teapot/updates/updates_min/adaptive</code> value. "
+    "Default resin: 150. Default teapot: 2200. "
+    "Default updates (minutes): 240. Default updates_min (minutes): 15. "
+    "Default adaptive: off. "
+    "With adaptive on, notes are refreshed right after the next cap or "
+    "finished timer, between updates_min and updates minutes."
     "\n"
     "❔ /get <code>type</code> - Get "
-    "<code>resin/teapot/updates</code> current value."
+    "<code>resin/teapot/updates/updates_min/adaptive</code> current value."
     "\n\n"
     "<b>Bot Usage</b>\n"
     "❔ /help - List of commands."
@@ -31,7 +41,7 @@ HELP = (
 
 
 def allowed(uid: str) -> bool:
-    return uid in ut.CLIENT
+    return uid in ut.CONFIG["accounts"]
 
 
 async def bot_help(update: Update, context: ut.Context) -> None:
@@ -46,20 +56,61 @@ async def menu(update: Update, context: ut.Context) -> None:
         await gui.main_menu(update)
 
 
+def admin(uid: str) -> bool:
+    return uid in [str(adm) for adm in ut.setting("admins", [])]
+
+
+async def _redeem(update: Update, uids: List[str], codes: List[str]) -> None:
+    await ut.send(update, render.redeem(await ut.redeem_many(uids, codes)))
+
+
 async def redeem(update: Update, context: ut.Context) -> None:
     uid = ut.uid(update)
     if allowed(uid):
-        if context.args:
-            msg = await ut.redeem(uid, context.args[0])
+        uids = [uid]
+        codes = context.args
+        everyone = bool(codes) and codes[0] == "all"
+        if everyone and admin(uid):
+            # every account, also the ones other shard workers serve
+            uids = list(ut.CONFIG["accounts"])
+            codes = codes[1:]
+        # duplicated codes would only hit the redeem cooldown
+        codes = list(dict.fromkeys(codes))
+        if everyone and not admin(uid):
+            msg = "Only admins can redeem gift codes for every account."
+        elif not codes:
+            msg = (
+                "Send the gift codes to redeem, "
+                "e.g. /redeem GENSHINGIFT or /redeem CODE1 CODE2"
+            )
+        elif len(codes) > ut.MAX_CODES:
+            msg = f"Send at most {ut.MAX_CODES} gift codes at once."
         else:
-            msg = "Send the gift code to redeem, e.g. /redeem GENSHINGIFT"
+            # codes wait out the cooldown and handlers run one at a time,
+            # redeem in the background
+            context.application.create_task(_redeem(update, uids, codes))
+            msg = (
+                f"Redeeming {len(codes)} gift codes for {len(uids)} "
+                f"accounts, results will follow."
+            )
         await ut.send(update, msg)
 
 
 async def set_value(update: Update, context: ut.Context) -> None:
     uid = ut.uid(update)
     if allowed(uid):
-        if context.args and len(context.args) == 2:
+        if (
+            context.args
+            and len(context.args) == 2
+            and context.args[0] == "adaptive"
+        ):
+            if context.args[1] in ("on", "off"):
+                value = 1 if context.args[1] == "on" else -1
+                await adb.set_adaptive(uid, value)
+                msg = f"Adaptive updates have been turned {context.args[1]}."
+            else:
+                msg = "Adaptive updates value must be on or off."
+        elif context.args and len(context.args) == 2:
             try:
                 value = int(context.args[1])
             except ValueError:
@@ -68,7 +119,7 @@ async def set_value(update: Update, context: ut.Context) -> None:
                 set_type = context.args[0]
                 if set_type == "resin":
                     if 0 < value < ut.MAX_RESIN:
-                        db.set_resin(uid, value)
+                        await adb.set_resin(uid, value)
                         msg = (
                             f"Resin notification threshold "
                             f"has been updated to {value}."
@@ -80,8 +131,9 @@ async def set_value(update: Update, context: ut.Context) -> None:
                             f"{ut.MAX_RESIN}."
                         )
                 elif set_type == "teapot":
-                    if 0 < value < db.teapot_max(uid) and not value % 30:
-                        db.set_teapot(uid, value)
+                    teapot_max = await adb.teapot_max(uid)
+                    if 0 < value < teapot_max and not value % 30:
+                        await adb.set_teapot(uid, value)
                         msg = (
                             f"Teapot currency notification threshold "
                             f"has been updated to {value}."
@@ -90,19 +142,33 @@ async def set_value(update: Update, context: ut.Context) -> None:
                         msg = (
                             f"Teapot currency notification threshold must "
                             f"be greater than 0, lower than "
-                            f"{db.teapot_max(uid)} and multiple of 30."
+                            f"{teapot_max} and multiple of 30."
                         )
                 elif set_type == "updates":
                     if value > 0:
-                        db.set_updates(uid, value)
+                        await adb.set_updates(uid, value)
                         msg = f"Updates interval has been updated to {value}."
                     else:
                         msg = "Updates interval must be greater than 0."
+                elif set_type == "updates_min":
+                    updates = await adb.updates(uid)
+                    if 0 < value <= updates:
+                        await adb.set_updates_min(uid, value)
+                        msg = (
+                            f"Minimum updates interval "
+                            f"has been updated to {value}."
+                        )
+                    else:
+                        msg = (
+                            f"Minimum updates interval must be greater "
+                            f"than 0 and not greater than "
+                            f"{updates}."
+                        )
         else:
             msg = (
                 "Send the type and value to be set: "
-                "resin, teapot or updates, e.g. /set resin 120, "
-                "/set updates 720"
+                "resin, teapot, updates, updates_min or adaptive, "
+                "e.g. /set resin 120, /set updates 720, /set adaptive on"
             )
         await ut.send(update, msg)
 
@@ -112,22 +178,87 @@ async def get_value(update: Update, context: ut.Context) -> None:
     if allowed(uid):
         if context.args and len(context.args) == 1:
             get_type = context.args[0]
+            user = await adb.user_settings(uid)
             if get_type == "resin":
                 msg = (
                     f"Current resin notification threshold "
-                    f"set to {db.resin(uid)}."
+                    f"set to {user.resin}."
                 )
             elif get_type == "teapot":
                 msg = (
                     f"Current teapot currency notification threshold "
-                    f"set to {db.teapot(uid)}."
+                    f"set to {user.teapot}."
                 )
             elif get_type == "updates":
-                msg = f"Current updates interval set to {db.updates(uid)}."
+                msg = f"Current updates interval set to {user.updates}."
+            elif get_type == "updates_min":
+                msg = (
+                    f"Current minimum updates interval "
+                    f"set to {user.updates_min}."
+                )
+            elif get_type == "adaptive":
+                state = "on" if user.adaptive == 1 else "off"
+                msg = f"Adaptive updates are {state}."
         else:
             msg = (
                 "Send the type to retrieve: "
-                "resin, teapot or updates, e.g. /get resin, "
-                "/get updates"
+                "resin, teapot, updates, updates_min or adaptive, "
+                "e.g. /get resin, /get updates"
+            )
+        await ut.send(update, msg)
+
+
+async def _profile_cpu(update: Update, seconds: float) -> None:
+    try:
+        report = await profiler.cpu(seconds)
+    except profiler.ProfilerError as exc:
+        await ut.send(update, str(exc))
+    else:
+        await ut.send_file(update, "cpu.txt", report, f"CPU ({seconds}s)")
+
+
+async def _profile_mem(update: Update, mode: str) -> None:
+    try:
+        if mode == "mem":
+            report = await profiler.snapshot()
+        else:
+            report = await profiler.diff()
+    except profiler.ProfilerError as exc:
+        await ut.send(update, str(exc))
+    else:
+        await ut.send_file(update, f"{mode}.txt", report)
+
+
+async def profile(update: Update, context: ut.Context) -> None:
+    uid = ut.uid(update)
+    if allowed(uid) and admin(uid):
+        args = context.args or []
+        mode = args[0] if args else ""
+        if mode == "cpu":
+            try:
+                seconds = float(args[1]) if len(args) > 1 else profiler.SECONDS
+            except ValueError:
+                seconds = 0
+            if 0 < seconds <= profiler.MAX_SECONDS:
+                # handlers run one at a time, profile in the background
+                context.application.create_task(_profile_cpu(update, seconds))
+                msg = f"Profiling the bot for {seconds} seconds."
+            else:
+                msg = (
+                    f"Seconds must be greater than 0 and not greater "
+                    f"than {profiler.MAX_SECONDS}."
+                )
+        elif mode in ("mem", "diff"):
+            context.application.create_task(_profile_mem(update, mode))
+            return
+        elif mode == "stop":
+            try:
+                msg = profiler.stop()
+            except profiler.ProfilerError as exc:
+                msg = str(exc)
+        else:
+            msg = (
+                "Send the profile type: cpu [seconds], mem, diff or stop, "
+                "e.g. /profile cpu 30, /profile mem"
             )
         await ut.send(update, msg)
@@ -4,15 +4,50 @@
 # This work is licensed under the terms of the MIT license.
 
 import calendar
-import datetime
-from typing import List, Tuple
+import functools
+from typing import Any, Callable, Dict, List, Tuple
 
-import database as db
+import aiodb as adb
+import metrics
 import utils as ut
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.error import BadRequest
 
 
+SEP = ":"
+SEASONS = {False: "current", True: "previous"}
+ROUTES: Dict[str, Tuple[Callable, Tuple[Callable, ...], Dict[str, Any]]] = {}
+
+
+def menu(route: str, *codec: Callable[[str], Any], **fixed: Any) -> Callable:
+    # codec converts each callback data argument, fixed are extra kwargs
+    def register(handler: Callable) -> Callable:
+        ROUTES[route] = (handler, codec, fixed)
+        return handler
+
+    return register
+
+
+def data(route: str, *args: Any) -> str:
+    return SEP.join((route, *(str(arg) for arg in args)))
+
+
+def is_previous(arg: str) -> bool:
+    return arg == SEASONS[True]
+
+
+async def dispatch(update: Update) -> None:
+    route, *args = update.callback_query.data.split(SEP)
+    # unknown or outdated buttons fall back to the main menu
+    if route not in ROUTES or len(args) != len(ROUTES[route][1]):
+        route, args = "main_menu", []
+    handler, codec, fixed = ROUTES[route]
+    with metrics.BUTTON_SECONDS.time(route):
+        await handler(
+            update, *(conv(arg) for conv, arg in zip(codec, args)), **fixed
+        )
+
+
 async def _answer(update: Update, msg: str = None) -> None:
     if update.callback_query is not None:
         try:
@@ -25,210 +60,250 @@ def button(buttons: List[Tuple[str, str]]):
     return [InlineKeyboardButton(bt[0], callback_data=bt[1]) for bt in buttons]
 
 
+MAIN_MENU_KB = InlineKeyboardMarkup(
+    [
+        button([("🗒 Daily Notes 🗒", data("notes_menu"))]),
+        button([("📖 Traveler's Diary 📖", data("diary_month_menu"))]),
+        button([("✨ Abyss ✨", data("abyss_seasons_menu"))]),
+        button([("⚙️ Notifications ⚙️", data("notifications_menu"))]),
+    ]
+)
+NOTES_KB = InlineKeyboardMarkup(
+    [
+        button([("🔃 Update 🔃", data("notes_update"))]),
+        button([("« Back to Menu", data("main_menu"))]),
+    ]
+)
+DIARY_KB = InlineKeyboardMarkup(
+    [
+        button(
+            [
+                ("« Back to Diary", data("diary_month_menu")),
+                ("« Back to Menu", data("main_menu")),
+            ]
+        )
+    ]
+)
+ABYSS_SEASONS_KB = InlineKeyboardMarkup(
+    [
+        button(
+            [
+                ("Current", data("abyss_floors_menu", SEASONS[False])),
+                ("Previous", data("abyss_floors_menu", SEASONS[True])),
+            ]
+        ),
+        button([("« Back to Menu", data("main_menu"))]),
+    ]
+)
+ABYSS_FLOORS_KB = {
+    prev: InlineKeyboardMarkup(
+        [
+            button([("All", data("abyss_menu", season, "all"))]),
+            button([(fl, data("abyss_menu", season, fl)) for fl in ut.FLOORS]),
+            button(
+                [
+                    ("« Back to Seasons", data("abyss_seasons_menu")),
+                    ("« Back to Menu", data("main_menu")),
+                ]
+            ),
+        ]
+    )
+    for prev, season in SEASONS.items()
+}
+ABYSS_KB = {
+    (prev, floor): InlineKeyboardMarkup(
+        [
+            button([("🔃 Update 🔃", data("abyss_update", season, floor))]),
+            button(
+                [
+                    ("« Back to Floors", data("abyss_floors_menu", season)),
+                    ("« Back to Seasons", data("abyss_seasons_menu")),
+                    ("« Back to Menu", data("main_menu")),
+                ]
+            ),
+        ]
+    )
+    for prev, season in SEASONS.items()
+    for floor in ("all", *ut.FLOORS)
+}
+
+
+@functools.lru_cache(maxsize=12)
+def diary_month_kb(month: int) -> InlineKeyboardMarkup:
+    # current month and the two before it, wrapping into last year
+    months = [(month - k - 1) % 12 + 1 for k in range(3)]
+    return InlineKeyboardMarkup(
+        [
+            button(
+                [
+                    (calendar.month_name[prev], data("diary_menu", prev))
+                    for prev in months
+                ]
+            ),
+            button([("« Back to Menu", data("main_menu"))]),
+        ]
+    )
+
+
+@menu("main_menu")
 async def main_menu(update: Update) -> None:
     await _answer(update)
-    kb = [
-        button([("🗒 Daily Notes 🗒", "notes_menu")]),
-        button([("📖 Traveler's Diary 📖", "diary_month_menu")]),
-        button([("✨ Abyss ✨", "abyss_seasons_menu")]),
-        button([("⚙️ Notifications ⚙️", "notifications_menu")]),
-    ]
     resp = ut.send
     if update.callback_query is not None:
         resp = ut.edit
-    await resp(update, "Menu", reply_markup=InlineKeyboardMarkup(kb))
+    await resp(update, "Menu", reply_markup=MAIN_MENU_KB)
 
 
-async def notes_menu(update: Update, context: ut.Context) -> None:
-    ut.autoupdate_notes(update, context)
-    msg, notes_data = await ut.notes(ut.uid(update))
+@menu("notes_update", force=True)
+@menu("notes_menu")
+async def notes_menu(update: Update, force: bool = False) -> None:
+    target = ut.target(update)
+    msg, notes_data = await ut.notes(ut.uid(update), force)
     await _answer(update)
-    ut.notifier_resin(update, context, notes_data.resin_time)
-    ut.notifier_teapot(update, context, notes_data)
-    ut.notifier_parametric(update, context, notes_data.parametric_time)
-    ut.notifier_expedition(update, context, notes_data.expeditions_max)
-    kb = [
-        button([("🔃 Update 🔃", "notes_menu")]),
-        button([("« Back to Menu", "main_menu")]),
-    ]
-    await ut.edit(update, msg, InlineKeyboardMarkup(kb))
+    await ut.autoupdate_notes(target, notes_data)
+    await ut.notifier_resin(target, notes_data.resin_time)
+    await ut.notifier_teapot(target, notes_data)
+    await ut.notifier_parametric(target, notes_data.parametric_time)
+    await ut.notifier_expedition(target, notes_data.expeditions_max)
+    await ut.edit(update, msg, NOTES_KB)
 
 
 async def update_notes(
-    update: Update, context: ut.Context, data: Tuple[str, ut.Notes] = None
+    target: ut.Target, data: Tuple[str, ut.Notes] = None
 ) -> None:
     if data is None:
-        msg, notes_data = await ut.notes(ut.uid(update))
+        msg, notes_data = await ut.notes(str(target.chat))
     else:
         msg, notes_data = data
-    ut.notifier_resin(update, context, notes_data.resin_time)
-    ut.notifier_teapot(update, context, notes_data)
-    ut.notifier_parametric(update, context, notes_data.parametric_time)
-    ut.notifier_expedition(update, context, notes_data.expeditions_max)
-    kb = [
-        button([("🔃 Update 🔃", "notes_menu")]),
-        button([("« Back to Menu", "main_menu")]),
-    ]
-    await ut.edit(update, msg, InlineKeyboardMarkup(kb))
+    await ut.autoupdate_notes(target, notes_data)
+    await ut.notifier_resin(target, notes_data.resin_time)
+    await ut.notifier_teapot(target, notes_data)
+    await ut.notifier_parametric(target, notes_data.parametric_time)
+    await ut.notifier_expedition(target, notes_data.expeditions_max)
+    await ut.edit_bot(ut.BOT, target, msg, NOTES_KB)
 
 
+@menu("diary_month_menu")
 async def diary_month_menu(update: Update) -> None:
     await _answer(update)
-    month = datetime.datetime.now().month
-    kb = [
-        button(
-            [
-                (calendar.month_name[month], f"diary_menu_{month}"),
-                (calendar.month_name[month - 1], f"diary_menu_{month-1}"),
-                (calendar.month_name[month - 2], f"diary_menu_{month-2}"),
-            ]
-        ),
-        button([("« Back to Menu", "main_menu")]),
-    ]
-    await ut.edit(update, "Traveler's Diary", InlineKeyboardMarkup(kb))
+    # same clock as ut.diary_data, which derives the year from it
+    month = ut.server_now().month
+    await ut.edit(update, "Traveler's Diary", diary_month_kb(month))
 
 
+@menu("diary_menu", int)
 async def diary_menu(update: Update, month: int) -> None:
     msg = await ut.diary(ut.uid(update), month)
     await _answer(update)
-    kb = [
-        button(
-            [
-                ("« Back to Diary", "diary_month_menu"),
-                ("« Back to Menu", "main_menu"),
-            ]
-        )
-    ]
-    await ut.edit(update, msg, InlineKeyboardMarkup(kb))
+    await ut.edit(update, msg, DIARY_KB)
 
 
+@menu("abyss_seasons_menu")
 async def abyss_seasons_menu(update: Update) -> None:
     await _answer(update)
-    kb = [
-        button(
-            [
-                ("Current", "abyss_floors_menu"),
-                ("Previous", "abyss_floors_menu_previous"),
-            ]
-        ),
-        button([("« Back to Menu", "main_menu")]),
-    ]
-    if update.callback_query is not None:
-        resp = ut.edit
-    await resp(update, "Abyss Seasons", reply_markup=InlineKeyboardMarkup(kb))
+    await ut.edit(update, "Abyss Seasons", reply_markup=ABYSS_SEASONS_KB)
 
 
+@menu("abyss_floors_menu", is_previous)
 async def abyss_floors_menu(update: Update, previous: bool) -> None:
     await _answer(update)
-    suffix = ""
-    season = "current"
-    if previous:
-        suffix = "_previous"
-        season = "previous"
-    kb = [
-        button([("All", f"abyss_menu{suffix}_all")]),
-        button(
-            [
-                ("9", f"abyss_menu{suffix}_9"),
-                ("10", f"abyss_menu{suffix}_10"),
-                ("11", f"abyss_menu{suffix}_11"),
-                ("12", f"abyss_menu{suffix}_12"),
-            ]
-        ),
-        button(
-            [
-                ("« Back to Seasons", "abyss_seasons_menu"),
-                ("« Back to Menu", "main_menu"),
-            ]
-        ),
-    ]
-    if update.callback_query is not None:
-        resp = ut.edit
-    await resp(
+    await ut.edit(
         update,
-        f"Abyss Floors ({season})",
-        reply_markup=InlineKeyboardMarkup(kb),
+        f"Abyss Floors ({SEASONS[previous]})",
+        reply_markup=ABYSS_FLOORS_KB[previous],
     )
 
 
-async def abyss_menu(update: Update, previous: bool, floor: str) -> None:
-    msg = await ut.abyss(ut.uid(update), previous, floor)
+@menu("abyss_update", is_previous, str, force=True)
+@menu("abyss_menu", is_previous, str)
+async def abyss_menu(
+    update: Update, previous: bool, floor: str, force: bool = False
+) -> None:
+    msg = await ut.abyss(ut.uid(update), previous, floor, force)
     await _answer(update)
-    suffix = ""
-    if previous:
-        suffix = "_previous"
-
-    kb = [
-        button([("🔃 Update 🔃", f"abyss_menu{suffix}_{floor}")]),
-        button(
-            [
-                ("« Back to Floors", f"abyss_floors_menu{suffix}"),
-                ("« Back to Seasons", "abyss_seasons_menu"),
-                ("« Back to Menu", "main_menu"),
-            ]
-        ),
-    ]
-    await ut.edit(update, msg, InlineKeyboardMarkup(kb))
+    await ut.edit(update, msg, ABYSS_KB.get((previous, floor)))
 
 
 def notification_icon(value: int) -> str:
     return "🔔" if value == 1 else "🔕"
 
 
+@functools.lru_cache(maxsize=256)
+def notifications_kb(
+    resin: int,
+    resin_warn: int,
+    teapot: int,
+    teapot_warn: int,
+    parametric_warn: int,
+    expedition_warn: int,
+) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        [
+            button(
+                [
+                    (
+                        f"Resin ({resin}): {notification_icon(resin_warn)}",
+                        data("notification_toggle", "resin"),
+                    )
+                ]
+            ),
+            button(
+                [
+                    (
+                        f"Teapot Currency ({teapot}): "
+                        f"{notification_icon(teapot_warn)}",
+                        data("notification_toggle", "teapot"),
+                    )
+                ]
+            ),
+            button(
+                [
+                    (
+                        f"Pt.Transformer: "
+                        f"{notification_icon(parametric_warn)}",
+                        data("notification_toggle", "parametric"),
+                    )
+                ]
+            ),
+            button(
+                [
+                    (
+                        f"Expeditions: "
+                        f"{notification_icon(expedition_warn)}",
+                        data("notification_toggle", "expedition"),
+                    )
+                ]
+            ),
+            button([("« Back to Menu", data("main_menu"))]),
+        ]
+    )
+
+
+@menu("notifications_menu")
 async def notifications_menu(update: Update) -> None:
     await _answer(update)
-    uid = ut.uid(update)
-    kb = [
-        button(
-            [
-                (
-                    f"Resin ({db.resin(uid)}): "
-                    f"{notification_icon(db.resin_warn(uid))}",
-                    "notification_toggle_resin",
-                )
-            ]
-        ),
-        button(
-            [
-                (
-                    f"Teapot Currency ({db.teapot(uid)}): "
-                    f"{notification_icon(db.teapot_warn(uid))}",
-                    "notification_toggle_teapot",
-                )
-            ]
-        ),
-        button(
-            [
-                (
-                    f"Pt.Transformer: "
-                    f"{notification_icon(db.parametric_warn(uid))}",
-                    "notification_toggle_parametric",
-                )
-            ]
-        ),
-        button(
-            [
-                (
-                    f"Expeditions: "
-                    f"{notification_icon(db.expedition_warn(uid))}",
-                    "notification_toggle_expedition",
-                )
-            ]
-        ),
-        button([("« Back to Menu", "main_menu")]),
-    ]
-    await ut.edit(update, "Notifications", InlineKeyboardMarkup(kb))
+    user = await adb.user_settings(ut.uid(update))
+    kb = notifications_kb(
+        user.resin,
+        user.resin_warn,
+        user.teapot,
+        user.teapot_warn,
+        user.parametric_warn,
+        user.expedition_warn,
+    )
+    await ut.edit(update, "Notifications", kb)
 
 
+@menu("notification_toggle", str)
 async def notification_toggle(update: Update, toggle: str) -> None:
     await _answer(update)
     uid = ut.uid(update)
     if toggle == "resin":
-        db.toggle_resin_warn(uid)
+        await adb.toggle_resin_warn(uid)
     elif toggle == "teapot":
-        db.toggle_teapot_warn(uid)
+        await adb.toggle_teapot_warn(uid)
     elif toggle == "parametric":
-        db.toggle_parametric_warn(uid)
+        await adb.toggle_parametric_warn(uid)
     elif toggle == "expedition":
-        db.toggle_expedition_warn(uid)
+        await adb.toggle_expedition_warn(uid)
     await notifications_menu(update)
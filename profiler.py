@@ -0,0 +1,111 @@
+# SPDX-License-Identifier: MIT
+
+# Copyright (c) 2021-2024 scmanjarrez. All rights reserved.
+# This work is licensed under the terms of the MIT license.
+
+import asyncio
+import cProfile
+import io
+import pstats
+import tracemalloc
+from typing import Callable, Optional
+
+
+SECONDS = 30
+MAX_SECONDS = 300
+TOP = 50
+FRAMES = 10
+_RUNNING = False
+_BASELINE: Optional[tracemalloc.Snapshot] = None
+_SNAPSHOTTING = False
+
+
+class ProfilerError(Exception):
+    pass
+
+
+async def cpu(seconds: float = SECONDS, top: int = TOP) -> str:
+    # the loop runs in this thread, so everything it executes while we
+    # sleep is profiled without restarting the bot
+    global _RUNNING
+    if _RUNNING:
+        raise ProfilerError("A CPU profile is already running.")
+    _RUNNING = True
+    prof = cProfile.Profile()
+    try:
+        prof.enable()
+        await asyncio.sleep(min(seconds, MAX_SECONDS))
+    finally:
+        prof.disable()
+        _RUNNING = False
+    out = io.StringIO()
+    stats = pstats.Stats(prof, stream=out)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+    out.write("\n")
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(top)
+    return out.getvalue()
+
+
+def _format(stats: list, title: str, top: int) -> str:
+    lines = [title, ""]
+    for stat in stats[:top]:
+        lines.append(str(stat))
+        lines.extend(f"    {line}" for line in stat.traceback.format())
+    return "\n".join(lines)
+
+
+async def _run(func: Callable[[int], str], top: int) -> str:
+    # snapshots of a large heap take seconds, keep them off the event loop
+    global _SNAPSHOTTING
+    if _SNAPSHOTTING:
+        raise ProfilerError("A memory snapshot is already running.")
+    _SNAPSHOTTING = True
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, func, top)
+    finally:
+        _SNAPSHOTTING = False
+
+
+async def snapshot(top: int = TOP) -> str:
+    return await _run(_snapshot, top)
+
+
+async def diff(top: int = TOP) -> str:
+    return await _run(_diff, top)
+
+
+def _snapshot(top: int) -> str:
+    # allocations made before tracemalloc.start() are not tracked, so the
+    # first report only shows what happened since tracing started
+    global _BASELINE
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(FRAMES)
+    _BASELINE = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    return _format(
+        _BASELINE.statistics("traceback"),
+        f"Top allocation sites (current {current} B, peak {peak} B)",
+        top,
+    )
+
+
+def _diff(top: int) -> str:
+    global _BASELINE
+    if not tracemalloc.is_tracing() or _BASELINE is None:
+        raise ProfilerError("No snapshot to compare with, take one first.")
+    current = tracemalloc.take_snapshot()
+    stats = current.compare_to(_BASELINE, "traceback")
+    _BASELINE = current
+    return _format(stats, "Allocation changes since last snapshot", top)
+
+
+def stop() -> str:
+    global _BASELINE
+    if _SNAPSHOTTING:
+        raise ProfilerError("A memory snapshot is running, try again later.")
+    _BASELINE = None
+    if not tracemalloc.is_tracing():
+        return "Allocations were not being traced."
+    tracemalloc.stop()
+    return "Stopped tracing allocations."
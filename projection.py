@@ -0,0 +1,107 @@
+# SPDX-License-Identifier: MIT
+
+# Copyright (c) 2021-2024 scmanjarrez. All rights reserved.
+# This work is licensed under the terms of the MIT license.
+
+import datetime
+import math
+import time
+from typing import Any, Dict, Optional
+
+
+RESIN_RATE = 8 * 60
+MAX_AGE = 4 * 60 * 60
+# alerts projected from younger snapshots are sent without asking HoYoLab
+TRUST = 30 * 60
+_SNAPSHOTS: Dict[str, "Snapshot"] = {}
+
+
+class Snapshot:
+    __slots__ = (
+        "taken",
+        "resin",
+        "resin_max",
+        "resin_seconds",
+        "teapot",
+        "teapot_max",
+        "teapot_seconds",
+    )
+
+    def __init__(
+        self,
+        taken: float,
+        resin: int,
+        resin_max: int,
+        resin_seconds: int,
+        teapot: int,
+        teapot_max: int,
+        teapot_seconds: int,
+    ) -> None:
+        self.taken = taken
+        self.resin = resin
+        self.resin_max = resin_max
+        self.resin_seconds = resin_seconds
+        self.teapot = teapot
+        self.teapot_max = teapot_max
+        self.teapot_seconds = teapot_seconds
+
+    @classmethod
+    def from_notes(cls, data: Any, taken: float = None) -> "Snapshot":
+        return cls(
+            time.time() if taken is None else taken,
+            data.resin,
+            data.resin_max,
+            int(data.resin_time.total_seconds()),
+            data.teapot,
+            data.teapot_max,
+            data.teapot_seconds,
+        )
+
+    @property
+    def resin_time(self) -> datetime.timedelta:
+        return datetime.timedelta(seconds=self.resin_seconds)
+
+    def age(self, now: float = None) -> float:
+        return (time.time() if now is None else now) - self.taken
+
+    def project(self, now: float = None) -> "Snapshot":
+        now = time.time() if now is None else now
+        elapsed = max(now - self.taken, 0)
+        resin_seconds = max(self.resin_seconds - elapsed, 0)
+        resin = self.resin
+        if self.resin_seconds:
+            # one point every RESIN_RATE seconds, the last one lands at 0
+            missing = math.ceil(resin_seconds / RESIN_RATE)
+            resin = max(self.resin_max - missing, self.resin)
+        teapot_seconds = max(self.teapot_seconds - elapsed, 0)
+        teapot = self.teapot
+        if self.teapot_seconds:
+            rate = (self.teapot_max - self.teapot) / self.teapot_seconds
+            teapot = min(self.teapot + int(rate * elapsed), self.teapot_max)
+        return Snapshot(
+            now,
+            resin,
+            self.resin_max,
+            int(resin_seconds),
+            teapot,
+            self.teapot_max,
+            int(teapot_seconds),
+        )
+
+
+def update(uid: str, data: Any) -> Snapshot:
+    snapshot = _SNAPSHOTS[uid] = Snapshot.from_notes(data)
+    return snapshot
+
+
+def project(uid: str, max_age: float = MAX_AGE) -> Optional[Snapshot]:
+    # None means the snapshot is missing or too old to be trusted
+    snapshot = _SNAPSHOTS.get(uid)
+    if snapshot is None or snapshot.age() > max_age:
+        return None
+    return snapshot.project()
+
+
+def age(uid: str) -> Optional[float]:
+    snapshot = _SNAPSHOTS.get(uid)
+    return None if snapshot is None else snapshot.age()
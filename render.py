@@ -0,0 +1,212 @@
+# SPDX-License-Identifier: MIT
+
+# Copyright (c) 2021-2024 scmanjarrez. All rights reserved.
+# This work is licensed under the terms of the MIT license.
+
+import calendar
+import datetime
+import functools
+import time
+from typing import Any, Dict, List, Tuple
+
+import pytz
+
+
+FLOORS = ("9", "10", "11", "12")
+TIME_FORMAT = "%Y/%m/%d %H:%M:%S"
+_STAMPS: Dict[str, Tuple[int, str]] = {}
+STATS = (
+    ("most_played", "Most played"),
+    ("most_kills", "Most kills"),
+    ("strongest_strike", "Strongest strike"),
+    ("most_damage_taken", "Most damage taken"),
+    ("most_bursts_used", "Most bursts used"),
+    ("most_skills_used", "Most skills used"),
+)
+
+# templates are bound str.format methods, parsed once at import time
+NOTES = (
+    "<b>Resin:</b> "
+    "<code>{resin}/{resin_max} ({resin_time})</code>\n"
+    "<b>Teapot Currency:</b> "
+    "<code>{teapot}/{teapot_max} ({teapot_time})</code>\n"
+    "<b>Parametric Transformer:</b> "
+    "<code>{parametric_time}</code>\n"
+    "<b>Commissions:</b> "
+    "<code>{commissions}/{commissions_max} ({commissions_claimed})</code>\n"
+    "<b>Weekly Boss Discounts:</b> "
+    "<code>{weeklies}/{weeklies_max}</code>\n"
+    "<b>Expeditions:</b>\n"
+    "{expeditions}\n"
+    "<b>Last updated</b>: <code>{updated}</code>"
+).format
+EXPEDITION = "    - Character {} => <code>{}</code>\n".format
+DIARY = "<b>Primogems earned in {}</b>: <code>{}</code>".format
+DIARY_CATEGORY = "    - {}: <code>{} ({} %)</code>".format
+ABYSS = (
+    "⚜ <b>{season} Season</b> ⚜\n\n"
+    "<b>Summary</b>:\n"
+    "    - <b>Deepest Descent:</b> "
+    "<code>{max_floor}</code>\n"
+    "    - <b>Battles Fought:</b> "
+    "<code>{total_battles} ({total_stars} ⭐️)</code>\n\n"
+    "{stats}"
+).format
+STAT = "    - <b>{}</b>:\n{}\n".format
+STAT_CHAR = "    » <code>{} ({})</code>".format
+CHAMBER = "    - <b>{} - {}</b>: {}/{} ⭐️\n{}\n".format
+BATTLE = "    » <code>{}</code>".format
+FLOORS_HEADER = "<b>Floors:</b>\n{}".format
+REDEEM_HEADER = "🎁 <b>Gift codes</b> 🎁\n".format
+REDEEM_CODE = "<code>{}</code>: {}".format
+REDEEM_CODES = "<code>{}</code>:".format
+REDEEM_GROUP = "    - {} ({}){}".format
+REDEEMED = "Code redeemed successfully."
+
+
+@functools.lru_cache(maxsize=None)
+def timezone(name: str) -> datetime.tzinfo:
+    return pytz.timezone(name)
+
+
+def last_updated(tz: str) -> str:
+    # the stamp has second resolution, refresh bursts share one strftime
+    now = int(time.time())
+    stamp = _STAMPS.get(tz)
+    if stamp is None or stamp[0] != now:
+        stamp = _STAMPS[tz] = (
+            now,
+            datetime.datetime.fromtimestamp(now, timezone(tz)).strftime(
+                TIME_FORMAT
+            ),
+        )
+    return stamp[1]
+
+
+def notes(data: Any, tz: str) -> str:
+    return NOTES(
+        resin=data.resin,
+        resin_max=data.resin_max,
+        resin_time=data.resin_time,
+        teapot=data.teapot,
+        teapot_max=data.teapot_max,
+        teapot_time=data.teapot_time,
+        parametric_time=data.parametric_time,
+        commissions=data.commissions,
+        commissions_max=data.commissions_max,
+        commissions_claimed=data.commissions_claimed,
+        weeklies=data.weeklies,
+        weeklies_max=data.weeklies_max,
+        expeditions=exp_chars(data.expeditions),
+        updated=last_updated(tz),
+    )
+
+
+def exp_chars(characters: List[Any]) -> str:
+    return "".join(
+        [
+            EXPEDITION(idx, "Finished" if ch.finished else ch.remaining_time)
+            for idx, ch in enumerate(characters, 1)
+        ]
+    )
+
+
+def diary(month: int, data: Dict[str, Any]) -> str:
+    msg = [DIARY(calendar.month_name[month], data["primogems"])]
+    msg.extend([DIARY_CATEGORY(*category) for category in data["categories"]])
+    return "\n".join(msg)
+
+
+def stat_chars(characters: List[Any]) -> str:
+    return "\n".join([STAT_CHAR(ch.name, ch.value) for ch in characters])
+
+
+def stats(ranks: Any) -> str:
+    categories = [getattr(ranks, category) for category, _ in STATS]
+    if not any(categories):
+        return ""
+    blocks = [
+        STAT(label, stat_chars(chars))
+        for (_, label), chars in zip(STATS, categories)
+    ]
+    return f"<b>Stats</b>:\n{''.join(blocks)}\n"
+
+
+def battle_chars(battles: List[Any]) -> str:
+    return "\n".join(
+        [
+            BATTLE(", ".join([char.name for char in battle.characters]))
+            for battle in battles
+        ]
+    )
+
+
+def floor(fl: Any) -> str:
+    return "".join(
+        [
+            CHAMBER(
+                fl.floor,
+                ch.chamber,
+                ch.stars,
+                ch.max_stars,
+                battle_chars(ch.battles),
+            )
+            for ch in fl.chambers
+        ]
+    )
+
+
+class AbyssView:
+    # summary, stats and every floor are rendered once per payload,
+    # switching floors only joins the cached fragments
+    __slots__ = ("head", "floors", "_pages")
+
+    def __init__(self, data: Any, previous: bool) -> None:
+        self.head = ABYSS(
+            season="Previous" if previous else "Current",
+            max_floor=data.max_floor,
+            total_battles=data.total_battles,
+            total_stars=data.total_stars,
+            stats=stats(data.ranks),
+        )
+        self.floors = [
+            (str(fl.floor), floor(fl))
+            for fl in data.floors
+            if str(fl.floor) in FLOORS
+        ]
+        self._pages: Dict[str, str] = {}
+
+    def render(self, selected: str = "all") -> str:
+        if selected not in FLOORS:
+            selected = "all"
+        page = self._pages.get(selected)
+        if page is None:
+            parsed = "\n".join(
+                [
+                    text
+                    for name, text in self.floors
+                    if selected == "all" or name == selected
+                ]
+            )
+            page = self.head
+            if parsed:
+                page += FLOORS_HEADER(parsed)
+            self._pages[selected] = page
+        return page
+
+
+def redeem(results: Dict[str, Dict[str, str]]) -> str:
+    # one line per code for a single account, grouped outcomes otherwise
+    msg = [REDEEM_HEADER()]
+    for code, accounts in results.items():
+        if len(accounts) == 1:
+            msg.append(REDEEM_CODE(code, *accounts.values()))
+            continue
+        groups: Dict[str, List[str]] = {}
+        for uid, outcome in accounts.items():
+            groups.setdefault(outcome, []).append(uid)
+        msg.append(REDEEM_CODES(code))
+        for outcome, uids in groups.items():
+            who = "" if outcome == REDEEMED else f": {', '.join(uids)}"
+            msg.append(REDEEM_GROUP(outcome, len(uids), who))
+    return "\n".join(msg)
@@ -0,0 +1,143 @@
+# SPDX-License-Identifier: MIT
+
+# Copyright (c) 2021-2024 scmanjarrez. All rights reserved.
+# This work is licensed under the terms of the MIT license.
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+
+Key = Tuple[str, str]
+Callback = Callable[[Any], Awaitable[None]]
+BATCH = 64
+
+
+class Event:
+    __slots__ = ("due", "seq", "key", "callback", "data", "cancelled")
+
+    def __init__(
+        self, due: float, seq: int, key: Key, callback: Callback, data: Any
+    ) -> None:
+        self.due = due
+        self.seq = seq
+        self.key = key
+        self.callback = callback
+        self.data = data
+        self.cancelled = False
+
+    def __lt__(self, other: "Event") -> bool:
+        return (self.due, self.seq) < (other.due, other.seq)
+
+
+class Scheduler:
+    def __init__(self, batch: int = BATCH) -> None:
+        self.batch = batch
+        self._heap: List[Event] = []
+        self._events: Dict[Key, Event] = {}
+        self._seq = itertools.count()
+        self._running: Set[asyncio.Task] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def schedule(
+        self,
+        uid: str,
+        kind: str,
+        delay: float,
+        callback: Callback,
+        data: Any = None,
+    ) -> None:
+        self.schedule_at(uid, kind, time.time() + delay, callback, data)
+
+    def schedule_at(
+        self,
+        uid: str,
+        kind: str,
+        due: float,
+        callback: Callback,
+        data: Any = None,
+    ) -> None:
+        self.cancel(uid, kind)
+        event = Event(due, next(self._seq), (uid, kind), callback, data)
+        self._events[event.key] = event
+        heapq.heappush(self._heap, event)
+        if self._heap[0] is event and self._wakeup is not None:
+            self._wakeup.set()
+
+    def cancel(self, uid: str, kind: str) -> bool:
+        # lazy deletion, cancelled events are dropped when they reach the top
+        event = self._events.pop((uid, kind), None)
+        if event is None:
+            return False
+        event.cancelled = True
+        if len(self._heap) > 2 * len(self._events) + self.batch:
+            self._heap = [ev for ev in self._heap if not ev.cancelled]
+            heapq.heapify(self._heap)
+        return True
+
+    def scheduled(self, uid: str, kind: str) -> bool:
+        return (uid, kind) in self._events
+
+    def kinds(self) -> Dict[str, int]:
+        count: Dict[str, int] = {}
+        for _, kind in self._events:
+            count[kind] = count.get(kind, 0) + 1
+        return count
+
+    def _pop_due(self, now: float) -> List[Event]:
+        batch = []
+        while self._heap and len(batch) < self.batch:
+            event = self._heap[0]
+            if not event.cancelled and event.due > now:
+                break
+            heapq.heappop(self._heap)
+            if not event.cancelled:
+                del self._events[event.key]
+                batch.append(event)
+        return batch
+
+    async def _dispatch(self, event: Event) -> None:
+        try:
+            await event.callback(event.data)
+        except Exception:
+            logging.exception(f"Scheduled event {event.key} failed")
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        while True:
+            self._wakeup.clear()
+            batch = self._pop_due(time.time())
+            for event in batch:
+                task = loop.create_task(self._dispatch(event))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+            if batch:
+                await asyncio.sleep(0)
+                continue
+            timeout = None
+            if self._heap:
+                timeout = max(self._heap[0].due - time.time(), 0)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for task in list(self._running):
+            task.cancel()
+        self._wakeup = None
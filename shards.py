@@ -0,0 +1,217 @@
+# SPDX-License-Identifier: MIT
+
+# Copyright (c) 2021-2024 scmanjarrez. All rights reserved.
+# This work is licensed under the terms of the MIT license.
+
+import asyncio
+import logging
+import multiprocessing
+import signal
+import zlib
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+from telegram import Bot, Update
+from telegram.ext import Application
+
+
+HOST = "127.0.0.1"
+PORT = 8450
+RETRY = 1.0
+TIMEOUT = 30
+CHECK = 5.0
+Handler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+def shard_of(key: str, count: int) -> int:
+    # stable across processes and restarts, unlike hash()
+    return zlib.crc32(key.encode()) % count
+
+
+def _stop_event() -> asyncio.Event:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    return stop
+
+
+async def _serve(
+    path: str, handler: Handler, host: str, port: int
+) -> web.AppRunner:
+    async def _receive(request: web.Request) -> web.Response:
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        await handler(data)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, _receive)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+class Forwarder:
+    # one queue and one sender per worker, so the updates of a chat reach
+    # its worker in the order Telegram sent them
+    def __init__(
+        self,
+        count: int,
+        key: Callable[[Dict[str, Any]], str],
+        port: int = PORT,
+        host: str = HOST,
+    ) -> None:
+        self.key = key
+        self.urls = [f"http://{host}:{port + idx}/" for idx in range(count)]
+        self._queues: List[asyncio.Queue] = []
+        self._tasks: List[asyncio.Task] = []
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def __len__(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
+
+    def start(self) -> None:
+        self._session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=TIMEOUT)
+        )
+        self._queues = [asyncio.Queue() for _ in self.urls]
+        self._tasks = [
+            asyncio.create_task(self._sender(idx))
+            for idx in range(len(self.urls))
+        ]
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._session is not None:
+            await self._session.close()
+
+    async def submit(self, data: Dict[str, Any]) -> None:
+        idx = shard_of(self.key(data), len(self.urls))
+        self._queues[idx].put_nowait(data)
+
+    async def _sender(self, idx: int) -> None:
+        queue = self._queues[idx]
+        while True:
+            data = await queue.get()
+            # a restarting worker is waited for, later updates stay queued
+            failures = 0
+            while True:
+                try:
+                    async with self._session.post(
+                        self.urls[idx], json=data
+                    ) as res:
+                        if res.status != 200:
+                            logging.error(
+                                f"Shard {idx} rejected update "
+                                f"{data.get('update_id')}: {res.status}"
+                            )
+                    break
+                except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                    if not failures:
+                        logging.warning(f"Shard {idx} unreachable: {exc!r}")
+                    failures += 1
+                    await asyncio.sleep(RETRY)
+
+
+class Workers:
+    def __init__(self, count: int, target: Callable[[int, int], None]):
+        self.count = count
+        self.target = target
+        # spawned, so workers do not inherit the front process state
+        self._context = multiprocessing.get_context("spawn")
+        self._procs: List[multiprocessing.Process] = []
+
+    def _spawn(self, idx: int) -> multiprocessing.Process:
+        proc = self._context.Process(
+            target=self.target, args=(idx, self.count), name=f"shard-{idx}"
+        )
+        proc.start()
+        return proc
+
+    def start(self) -> None:
+        self._procs = [self._spawn(idx) for idx in range(self.count)]
+
+    def check(self) -> None:
+        for idx, proc in enumerate(self._procs):
+            if not proc.is_alive():
+                logging.error(
+                    f"Shard {idx} exited with {proc.exitcode}, restarting"
+                )
+                self._procs[idx] = self._spawn(idx)
+
+    def stop(self) -> None:
+        for proc in self._procs:
+            proc.terminate()
+        for proc in self._procs:
+            proc.join()
+
+
+async def front(
+    bot: Bot,
+    forwarder: Forwarder,
+    workers: Workers,
+    listen: str,
+    port: int,
+    url_path: str,
+    webhook_url: str,
+    cert: Optional[str] = None,
+) -> None:
+    stop = _stop_event()
+    workers.start()
+    forwarder.start()
+    runner = await _serve(f"/{url_path}", forwarder.submit, listen, port)
+    certificate = None
+    if cert is not None:
+        with open(cert, "rb") as f:
+            certificate = f.read()
+    async with bot:
+        await bot.set_webhook(webhook_url, certificate=certificate)
+    try:
+        while not stop.is_set():
+            workers.check()
+            try:
+                await asyncio.wait_for(stop.wait(), CHECK)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        await runner.cleanup()
+        if len(forwarder):
+            logging.warning(f"Dropping {len(forwarder)} queued updates")
+        await forwarder.close()
+        workers.stop()
+
+
+async def worker(
+    application: Application,
+    port: int,
+    host: str = HOST,
+    post_shutdown: Optional[Callable[[Application], Awaitable[None]]] = None,
+) -> None:
+    # updates are processed one at a time from the queue, as they are
+    # with the built-in webhook server
+    async def _enqueue(data: Dict[str, Any]) -> None:
+        await application.update_queue.put(
+            Update.de_json(data, application.bot)
+        )
+
+    stop = _stop_event()
+    await application.initialize()
+    if application.post_init is not None:
+        await application.post_init(application)
+    await application.start()
+    runner = await _serve("/", _enqueue, host, port)
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+        await application.stop()
+        await application.shutdown()
+        if post_shutdown is not None:
+            await post_shutdown(application)
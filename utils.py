@@ -3,42 +3,101 @@
 # Copyright (c) 2021-2024 scmanjarrez. All rights reserved.
 # This work is licensed under the terms of the MIT license.
 
-import calendar
+import asyncio
 import datetime
+import functools
+import itertools
 import json
 import logging
-import traceback
+import time
+import zlib
+from collections import OrderedDict
 from enum import Enum
-from typing import List, Tuple, Union
-
-import aiohttp
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+
+import aiodb as adb
+import clients
+import cookies
 
 import database as db
 import genshin
+import limiter
+import metrics
+import outbox
 
 import paimon_gui as gui
+import projection
 import pytz
+import render
+import scheduler
+import shards
 from telegram import Bot, InlineKeyboardMarkup, Update
 from telegram.constants import ParseMode
 from telegram.error import BadRequest
-from telegram.ext import ContextTypes, JobQueue
+from telegram.ext import Application, ContextTypes
 
 
 # Global
 CONF_FILE = ".config.json"
 CONFIG = None
-CLIENT = {}
+BOT = None
 MAX_RESIN = 160
-FLOORS = ("9", "10", "11", "12")
+FLOORS = render.FLOORS
+CONCURRENCY = 8
+NOTES_TTL = 60
+ABYSS_TTL = 300
+DIARY_TTL = 600
+REHYDRATE_SPREAD = 60
+REFRESH_MARGIN = 30
+REDEEM_COOLDOWN = 5.5
+MAX_CODES = 10
+CHECKIN_WINDOW = 60 * 60
+CHECKIN_CONCURRENCY = 4
+CHECKIN_RETRIES = 3
+CHECKIN_BACKOFF = 60
+CHECKIN_DONE = ("claimed", "already_claimed")
+COOKIE_INVALID = "Invalid cookies. Check config file."
+COOKIE_RENEW = "Could not renew cookie_token using stoken."
+COOKIE_EMPTY = "Could not redeem cookie_token because stoken is empty."
+API_RATE = 5
+API_BURST = 10
+ACCOUNT_RATE = 0.5
+ACCOUNT_BURST = 3
+LIMITER = limiter.RateLimiter(API_RATE, API_BURST, ACCOUNT_RATE, ACCOUNT_BURST)
+OUTBOX = outbox.Outbox()
+EDIT_CACHE = 4096
+SERVER_TZ = pytz.timezone("Asia/Shanghai")
+_MISSING = object()
+SHARD = 0
+SHARDS = 1
 
 # Type aliases
 Context = ContextTypes.DEFAULT_TYPE
 TimeDelta = datetime.timedelta
 ExpChars = List[genshin.models.genshin.chronicle.notes.Expedition]
-Floors = List[genshin.models.genshin.chronicle.abyss.Floor]
-Battles = List[genshin.models.genshin.chronicle.abyss.Battle]
-Stats = genshin.models.genshin.chronicle.abyss.CharacterRanks
-StatChars = List[genshin.models.genshin.chronicle.abyss.AbyssRankCharacter]
+Abyss = genshin.models.genshin.chronicle.abyss.SpiralAbyss
+SCHEDULER = scheduler.Scheduler()
+CLIENTS: clients.ClientPool = None
+COOKIES: cookies.CookieService = None
+COOKIE_CHECK = 60 * 60
+CHECKIN_LIMIT: asyncio.Semaphore = None
+_NOTES: Dict[str, Tuple[float, asyncio.Future]] = {}
+# (rendered hash or None when unknown, sequence of the last submitted edit)
+_EDITS: "OrderedDict[Tuple[int, int], Tuple[Optional[int], int]]" = (
+    OrderedDict()
+)
+_EDIT_SEQ = itertools.count()
+_ABYSS: Dict[Tuple[str, bool], Tuple[float, Abyss, render.AbyssView]] = {}
 LOG_FILT = [
     "Removed job",
     "Added job",
@@ -59,12 +118,19 @@ class NoLog(logging.Filter):
         return logged
 
 
+class Target(NamedTuple):
+    chat: int
+    message: int
+
+
 class CMD(Enum):
     NOP = ""
     GIFT = "redeem"
     RESIN = "resin"
     TEAPOT = "teapot"
     UPDATES = "updates"
+    UPDATES_MIN = "updates_min"
+    ADAPTIVE = "adaptive"
 
 
 class Notes:
@@ -146,31 +212,146 @@ class Notes:
         ).remaining_time
 
 
-def set_up() -> None:
+def set_up(shard: int = 0, count: int = 1) -> None:
     db.setup_db()
-    global CONFIG, CLIENT
+    global CONFIG, CLIENTS, COOKIES, LIMITER, OUTBOX, SHARD, SHARDS
+    SHARD, SHARDS = shard, count
     with open(CONF_FILE) as f:
         CONFIG = json.load(f)
     try:
         logging.getLogger().setLevel(setting("log_level").upper())
     except KeyError:
         pass
-    for acc in CONFIG["accounts"]:
-        CLIENT[acc] = genshin.Client(
-            {
-                "ltoken": account(acc, "ltoken"),
-                "ltuid": account(acc, "ltuid"),
-                "account_id": account(acc, "ltuid"),
-                "cookie_token": account(acc, "ctoken"),
-            }
+    # bot-wide budgets are split between shard workers, per account and
+    # per chat ones stay as they are because a shard owns its chats
+    LIMITER = limiter.RateLimiter(
+        setting("api_rate", API_RATE) / count,
+        max(setting("api_burst", API_BURST) // count, 1),
+        setting("account_rate", ACCOUNT_RATE),
+        setting("account_burst", ACCOUNT_BURST),
+    )
+    OUTBOX = outbox.Outbox(
+        setting("telegram_rate", outbox.GLOBAL_RATE) / count,
+        setting("telegram_chat_interval", outbox.CHAT_INTERVAL),
+    )
+    CLIENTS = clients.ClientPool(
+        new_client,
+        setting("client_cache", clients.CAPACITY),
+        setting("client_idle", clients.IDLE),
+    )
+    COOKIES = cookies.CookieService(
+        CONF_FILE,
+        CONFIG,
+        CLIENTS.drop,
+        LIMITER,
+        setting("cookie_refresh", cookies.INTERVAL),
+    )
+    db.add_users(accounts())
+
+
+def new_client(uid: str) -> genshin.Client:
+    client = genshin.Client(
+        {
+            "ltoken": account(uid, "ltoken"),
+            "ltuid": account(uid, "ltuid"),
+            "account_id": account(uid, "ltuid"),
+            "cookie_token": account(uid, "ctoken"),
+        }
+    )
+    client.default_game = "genshin"
+    return client
+
+
+def owned(uid: str) -> bool:
+    return SHARDS == 1 or shards.shard_of(uid, SHARDS) == SHARD
+
+
+def accounts() -> List[str]:
+    # accounts served by this process, every account unless sharded
+    return [uid for uid in CONFIG["accounts"] if owned(uid)]
+
+
+async def api(uid: str, method: str, *args, **kwargs) -> Any:
+    for retry in (False, True):
+        waited = await LIMITER.acquire(uid)
+        if waited > 1:
+            logging.info(f"HoYoLab {method} for {uid} queued {waited:.2f}s")
+        try:
+            with metrics.hoyolab(method):
+                client = CLIENTS.get(uid)
+                return await getattr(client, method)(*args, **kwargs)
+        except genshin.errors.InvalidCookies:
+            # renewal drops the cached client, the retry uses the new cookies
+            if retry or not await COOKIES.renew(uid):
+                raise
+
+
+async def refresh_cookies(context: Context = None) -> None:
+    renewed = await COOKIES.refresh(accounts())
+    if renewed:
+        logging.info(f"Renewed cookie_token of {renewed} accounts")
+
+
+async def post_init(application: Application) -> None:
+    global BOT
+    BOT = application.bot
+    await rehydrate()
+    SCHEDULER.start()
+    try:
+        port = setting("metrics_port")
+    except KeyError:
+        pass
+    else:
+        observe(application)
+        # each shard worker serves its own metrics on the next port
+        await metrics.serve(
+            port + SHARD, setting("metrics_host", metrics.HOST)
         )
-        CLIENT[acc].default_game = "genshin"
-        if not db.cached(acc):
-            db.add_user(acc)
 
 
-def setting(key: str) -> str:
-    return CONFIG["settings"][key]
+async def post_shutdown(application: Application) -> None:
+    await SCHEDULER.stop()
+    await COOKIES.close()
+    # waits for the deferred database writes
+    adb.shutdown()
+
+
+def observe(application: Application) -> None:
+    def _jobs() -> Dict[Tuple[str], int]:
+        jobs: Dict[Tuple[str], int] = {}
+        for job in application.job_queue.jobs():
+            jobs[(job.name,)] = jobs.get((job.name,), 0) + 1
+        return jobs
+
+    def _limiter(key: str) -> Callable[[], Dict[Tuple[str], float]]:
+        # accounts are summed when queued and the longest wait otherwise
+        merge = sum if key == "queued" else functools.partial(max, default=0)
+
+        def _stats() -> Dict[Tuple[str], float]:
+            stats = LIMITER.stats()
+            values = {(limiter.GLOBAL,): stats.pop(limiter.GLOBAL)[key]}
+            values[("accounts",)] = merge(st[key] for st in stats.values())
+            return values
+
+        return _stats
+
+    metrics.SCHEDULED.callback = lambda: {
+        (kind,): count for kind, count in SCHEDULER.kinds().items()
+    }
+    metrics.JOB_QUEUE.callback = _jobs
+    metrics.OUTBOX_QUEUED.callback = lambda: {(): len(OUTBOX)}
+    metrics.LIMITER_QUEUED.callback = _limiter("queued")
+    metrics.LIMITER_WAIT.callback = _limiter("wait")
+    metrics.LIMITER_LAST_WAIT.callback = _limiter("last_wait")
+
+
+def setting(key: str, default: Any = _MISSING) -> Any:
+    try:
+        return CONFIG["settings"][key]
+    except KeyError:
+        if default is _MISSING:
+            raise
+        return default
 
 
 def account(uid: str, key: str) -> Union[str, int]:
@@ -187,25 +368,113 @@ async def send(
     button: bool = False,
     quote: bool = True,
     reply_markup: InlineKeyboardMarkup = None,
-) -> None:
+) -> asyncio.Future:
     if button:
-        await update.callback_query.message.chat.send_message(
-            msg, ParseMode.HTML
+        factory = functools.partial(
+            _tracked,
+            "send_message",
+            update.callback_query.message.chat.send_message,
+            msg,
+            ParseMode.HTML,
         )
     else:
-        await update.message.reply_html(
+        factory = functools.partial(
+            _tracked,
+            "send_message",
+            update.message.reply_html,
             msg,
             quote=quote,
             reply_markup=reply_markup,
             disable_web_page_preview=True,
         )
+    return OUTBOX.submit(update.effective_message.chat.id, factory)
+
+
+async def send_file(
+    update: Update, name: str, data: str, caption: str = None
+) -> asyncio.Future:
+    return OUTBOX.submit(
+        update.effective_message.chat.id,
+        functools.partial(
+            _tracked,
+            "send_document",
+            update.effective_message.reply_document,
+            data.encode(),
+            caption,
+            filename=name,
+        ),
+    )
 
 
 async def send_bot(
     bot: Bot, uid: int, msg: str, reply_markup: InlineKeyboardMarkup = None
-) -> None:
-    await bot.send_message(
+) -> asyncio.Future:
+    return OUTBOX.submit(
         uid,
+        functools.partial(
+            _tracked,
+            "send_message",
+            bot.send_message,
+            uid,
+            msg,
+            ParseMode.HTML,
+            reply_markup=reply_markup,
+            disable_web_page_preview=True,
+        ),
+    )
+
+
+def _rendered(msg: str, reply_markup: InlineKeyboardMarkup = None) -> int:
+    markup = reply_markup.to_json() if reply_markup is not None else None
+    return hash((msg, markup))
+
+
+def _submitted(key: Tuple[int, int], rendered: int) -> Optional[int]:
+    # optimistic: the entry holds what the message will show once the
+    # queued edits are delivered, None means the edit can be skipped
+    entry = _EDITS.get(key)
+    if entry is not None and entry[0] == rendered:
+        _EDITS.move_to_end(key)
+        return None
+    seq = next(_EDIT_SEQ)
+    _store(key, rendered, seq)
+    return seq
+
+
+def _store(key: Tuple[int, int], rendered: Optional[int], seq: int) -> None:
+    # a delivered edit must not replace the entry of a newer queued one
+    entry = _EDITS.get(key)
+    if entry is not None and entry[1] > seq:
+        return
+    _EDITS[key] = (rendered, seq)
+    _EDITS.move_to_end(key)
+    while len(_EDITS) > EDIT_CACHE:
+        _EDITS.popitem(last=False)
+
+
+async def _tracked(method: str, call: Callable, *args, **kwargs) -> Any:
+    with metrics.telegram(method):
+        return await call(*args, **kwargs)
+
+
+def _skipped() -> asyncio.Future:
+    metrics.TELEGRAM_SKIPPED.inc()
+    future = asyncio.get_running_loop().create_future()
+    future.set_result(None)
+    return future
+
+
+async def edit(
+    update: Update, msg: str, reply_markup: InlineKeyboardMarkup = None
+) -> asyncio.Future:
+    key = (
+        update.effective_message.chat.id,
+        update.effective_message.message_id,
+    )
+    return _queue_edit(
+        key,
+        _rendered(msg, reply_markup),
+        update.callback_query.edit_message_text,
         msg,
         ParseMode.HTML,
         reply_markup=reply_markup,
@@ -213,420 +482,553 @@ async def send_bot(
     )
 
 
-async def edit(
-    update: Update, msg: str, reply_markup: InlineKeyboardMarkup = None
+async def edit_bot(
+    bot: Bot,
+    target: Target,
+    msg: str,
+    reply_markup: InlineKeyboardMarkup = None,
+) -> asyncio.Future:
+    return _queue_edit(
+        target,
+        _rendered(msg, reply_markup),
+        bot.edit_message_text,
+        msg,
+        chat_id=target.chat,
+        message_id=target.message,
+        parse_mode=ParseMode.HTML,
+        reply_markup=reply_markup,
+        disable_web_page_preview=True,
+    )
+
+
+def _queue_edit(
+    key: Tuple[int, int], rendered: int, call: Callable, *args, **kwargs
+) -> asyncio.Future:
+    seq = _submitted(key, rendered)
+    if seq is None:
+        return _skipped()
+    return OUTBOX.submit(
+        key[0],
+        functools.partial(_edit, key, rendered, seq, call, *args, **kwargs),
+    )
+
+
+async def _edit(
+    key: Tuple[int, int],
+    rendered: int,
+    seq: int,
+    call: Callable,
+    *args,
+    **kwargs,
 ) -> None:
     try:
-        await update.callback_query.edit_message_text(
-            msg,
-            ParseMode.HTML,
-            reply_markup=reply_markup,
-            disable_web_page_preview=True,
-        )
+        await _tracked("edit_message_text", call, *args, **kwargs)
     except BadRequest as br:
-        if not str(br).startswith("Message is not modified:"):
-            print(
-                f"***  Exception caught in edit "
-                f"({update.effective_message.chat.id}): ",
-                br,
-            )
-            traceback.print_stack()
+        if str(br).startswith("Message is not modified:"):
+            _store(key, rendered, seq)
+        else:
+            _store(key, None, seq)
+            logging.error(f"Could not edit message ({key[0]}): {br}")
+    except Exception:
+        # timeouts, network errors and flood control leave the message
+        # as it was, so the next identical edit has to be sent
+        _store(key, None, seq)
+        raise
+    else:
+        _store(key, rendered, seq)
 
 
-def _remove_job(queue: JobQueue, name: str) -> None:
-    current_jobs = queue.get_jobs_by_name(name)
-    if current_jobs:
-        for job in current_jobs:
-            # print(f"INFO: Removing job: {name}")
-            job.schedule_removal()
+async def updatedb_callback(context: Context = None) -> None:
+    limit = asyncio.Semaphore(setting("concurrency", CONCURRENCY))
 
+    async def _teapot_max(uid: str) -> Tuple[str, int]:
+        async with limit:
+            _, notes_data = await notes(uid)
+        return uid, notes_data.teapot_max
 
-async def updatedb_callback(context: Context = None) -> None:
-    for uid in CLIENT:
-        _, notes_data = await notes(uid)
-        db.set_teapot_max(uid, notes_data.teapot_max)
+    uids = accounts()
+    results = await asyncio.gather(
+        *(_teapot_max(uid) for uid in uids), return_exceptions=True
+    )
+    values = []
+    for uid, res in zip(uids, results):
+        if isinstance(res, genshin.errors.InvalidCookies):
+            logging.warning(f"Invalid cookies for {uid}. Check config file.")
+        elif isinstance(res, Exception):
+            logging.error(f"Could not update {uid}: {res!r}")
+        else:
+            values.append(res)
+    await adb.set_teapot_max_many(values)
 
 
 async def update_db(context: Context) -> None:
     await updatedb_callback()
 
 
+def server_now() -> datetime.datetime:
+    return datetime.datetime.now(SERVER_TZ)
+
+
+def server_day() -> str:
+    return server_now().date().isoformat()
+
+
+def checkin_offset(uid: str, window: float) -> float:
+    # stable per account, so a restart keeps the same spread
+    return zlib.crc32(uid.encode()) / 2**32 * window
+
+
 async def daily_callback(context: Context = None) -> None:
-    for uid, client in CLIENT.items():
+    global CHECKIN_LIMIT
+    CHECKIN_LIMIT = asyncio.Semaphore(
+        setting("checkin_concurrency", CHECKIN_CONCURRENCY)
+    )
+    day = server_day()
+    done = await adb.checkins(day)
+    window = setting("checkin_window", CHECKIN_WINDOW)
+    now = time.time()
+    for uid in accounts():
+        status, attempts = done.get(uid, (None, 0))
+        if status in CHECKIN_DONE:
+            continue
+        SCHEDULER.schedule_at(
+            uid,
+            "checkin",
+            now + checkin_offset(uid, window),
+            _checkin,
+            (uid, day, attempts),
+        )
+
+
+async def _checkin(data: Tuple[str, str, int]) -> None:
+    uid, day, attempts = data
+    if day != server_day():
+        return
+    attempts += 1
+    reward = None
+    async with CHECKIN_LIMIT:
         try:
-            # reward = await client.claim_daily_reward()
-            await client.claim_daily_reward()
+            claimed = await api(uid, "claim_daily_reward")
         except genshin.AlreadyClaimed:
-            # print(f"INFO: Daily already claimed: {uid}")
-            pass
+            status = "already_claimed"
         except genshin.errors.InvalidCookies:
-            pass
+            status = "invalid_cookies"
+        except Exception as exc:
+            status = "failed"
+            retries = setting("checkin_retries", CHECKIN_RETRIES)
+            if attempts <= retries:
+                status = "retrying"
+                backoff = setting("checkin_backoff", CHECKIN_BACKOFF)
+                delay = backoff * 2 ** (attempts - 1)
+                SCHEDULER.schedule(
+                    uid, "checkin", delay, _checkin, (uid, day, attempts)
+                )
+            logging.warning(f"Check-in {status} for {uid}: {exc!r}")
         else:
-            # print(f"INFO: Claimed {reward.amount}x {reward.name}")
-            pass
+            status = "claimed"
+            reward = f"{claimed.amount}x {claimed.name}"
+    await adb.set_checkin(uid, day, status, attempts, reward, time.time())
 
 
 async def daily_checkin(context: Context) -> None:
     await daily_callback()
-    midnight = datetime.time(minute=10, tzinfo=pytz.timezone("Asia/Shanghai"))
-    context.job_queue.run_daily(daily_callback, midnight, name="daily_checkin")
+    reset = datetime.time(tzinfo=SERVER_TZ)
+    context.job_queue.run_daily(daily_callback, reset, name="daily_checkin")
 
 
-async def update_notes(context: Context) -> None:
-    await gui.update_notes(context.job.data, context)
+def target(update: Update) -> Target:
+    return Target(
+        update.effective_message.chat.id, update.effective_message.message_id
+    )
 
 
-def autoupdate_notes(update: Update, context: Context) -> None:
-    queue = context.job_queue
-    _remove_job(queue, f"autoupdate_notes_{uid(update)}")
-    queue.run_repeating(
-        update_notes,
-        db.updates(uid(update)) * 60,
-        name=f"autoupdate_notes_{uid(update)}",
-        data=update,
+def schedule(target: Target, kind: str, delay: float) -> None:
+    due = time.time() + delay
+    SCHEDULER.schedule_at(str(target.chat), kind, due, _notify, (kind, target))
+    adb.defer(
+        db.set_schedule,
+        str(target.chat),
+        kind,
+        due,
+        target.chat,
+        target.message,
     )
 
 
-def resin_time(update: Update) -> Tuple[int, int]:
-    resin = db.resin(uid(update))
+def unschedule(uid: str, kind: str) -> None:
+    if SCHEDULER.cancel(uid, kind):
+        adb.defer(db.del_schedule, uid, kind)
+
+
+async def _notify(data: Tuple[str, Target]) -> None:
+    kind, target = data
+    await adb.del_schedule(str(target.chat), kind)
+    await NOTIFY[kind](target)
+
+
+async def rehydrate() -> None:
+    # overdue events are spread so a restart does not burst HoYoLab
+    now = time.time()
+    rows = await adb.schedules()
+    accs = CONFIG["accounts"]
+    stale = [(row[0], row[1]) for row in rows if row[0] not in accs]
+    rows = [
+        row
+        for row in rows
+        if row[0] in accs and row[1] in NOTIFY and owned(row[0])
+    ]
+    overdue = sum(1 for row in rows if row[2] <= now)
+    step = setting("rehydrate_spread", REHYDRATE_SPREAD) / max(overdue, 1)
+    idx = 0
+    for uid, kind, due, chat, message in rows:
+        if due <= now:
+            due = now + idx * step
+            idx += 1
+        SCHEDULER.schedule_at(
+            uid, kind, due, _notify, (kind, Target(chat, message))
+        )
+    await adb.del_schedules(stale)
+
+
+async def update_notes(target: Target) -> None:
+    await autoupdate_notes(target)
+    await gui.update_notes(target)
+
+
+def refresh_interval(user: db.User, data: Notes = None) -> float:
+    upper = user.updates * 60
+    if user.adaptive != 1 or data is None:
+        return upper
+    lower = min(user.updates_min, user.updates) * 60
+    events = [
+        data.resin_time.total_seconds(),
+        data.teapot_seconds,
+    ]
+    if data.expeditions:
+        events.append(data.expeditions_max.total_seconds())
+    if data.parametric_time is not None:
+        events.append(data.parametric_time.total_seconds())
+    events = [ev for ev in events if ev > 0]
+    if not events:
+        return upper
+    # refresh right after the earliest event so the message shows it
+    return min(max(min(events) + REFRESH_MARGIN, lower), upper)
+
+
+async def autoupdate_notes(target: Target, data: Notes = None) -> None:
+    user = await adb.user_settings(str(target.chat))
+    schedule(target, "autoupdate_notes", refresh_interval(user, data))
+
+
+async def resin_time(uid: str) -> Tuple[int, int]:
+    resin = await adb.resin(uid)
     return resin, ((MAX_RESIN - resin) * 8 * 60)
 
 
-async def notify_resin(context: Context) -> None:
-    update = context.job.data
-    msg, notes_data = await notes(uid(update))
+async def projected(
+    uid: str,
+) -> Tuple[Optional[Tuple[str, Notes]], Union[Notes, projection.Snapshot]]:
+    # HoYoLab is only queried when the last snapshot is too old to project
+    max_age = setting("projection_max_age", projection.MAX_AGE)
+    data = projection.project(uid, max_age)
+    if data is not None:
+        return None, data
+    fetched = await notes(uid)
+    return fetched, fetched[1]
+
+
+async def confirmed(
+    uid: str, due: Callable[[str, Any], Awaitable[bool]]
+) -> Tuple[Optional[Tuple[str, Notes]], Union[Notes, projection.Snapshot]]:
+    # alerts projected from old snapshots are confirmed with fresh notes,
+    # spent resin or currency only shows up in HoYoLab
+    fetched, data = await projected(uid)
+    trust = setting("projection_trust", projection.TRUST)
+    if (
+        fetched is None
+        and projection.age(uid) > trust
+        and await due(uid, data)
+    ):
+        fetched = await notes(uid)
+        data = fetched[1]
+    return fetched, data
+
+
+async def resin_due(uid: str, data: Union[Notes, projection.Snapshot]) -> bool:
+    _, warn_seconds = await resin_time(uid)
+    return data.resin_time.seconds <= warn_seconds
+
+
+async def notify_resin(target: Target) -> None:
+    fetched, notes_data = await confirmed(str(target.chat), resin_due)
     seconds = notes_data.resin_time.seconds
     if not seconds:
-        await send(
-            update, "‼ Hey, your resin has reached the cap!", button=True
+        await send_bot(
+            BOT, target.chat, "‼ Hey, your resin has reached the cap!"
         )
     else:
-        resin, warn_seconds = resin_time(update)
+        resin, warn_seconds = await resin_time(str(target.chat))
         if seconds <= warn_seconds:
-            await send(
-                update, f"⚠️ Hey, your resin is over {resin}!", button=True
+            await send_bot(
+                BOT, target.chat, f"⚠️ Hey, your resin is over {resin}!"
             )
-        notifier_resin(update, context, notes_data.resin_time)
-    await gui.update_notes(update, context, (msg, notes_data))
+        await notifier_resin(target, notes_data.resin_time)
+    if fetched is not None:
+        await gui.update_notes(target, fetched)
 
 
-def notifier_resin(update: Update, context: Context, resin: TimeDelta) -> None:
-    queue = context.job_queue
-    _remove_job(queue, f"resin_{uid(update)}")
-    if db.resin_warn(uid(update)) == 1:
+async def notifier_resin(target: Target, resin: TimeDelta) -> None:
+    _uid = str(target.chat)
+    unschedule(_uid, "resin")
+    if await adb.resin_warn(_uid) == 1:
         if resin.seconds:
-            _, warn_seconds = resin_time(update)
+            _, warn_seconds = await resin_time(_uid)
             warn = resin.seconds - warn_seconds
             if warn <= 0:
                 warn = resin.seconds
-            queue.run_once(
-                notify_resin, warn, name=f"resin_{uid(update)}", data=update
-            )
+            schedule(target, "resin", warn)
 
 
-def teapot_time(update: Update, data: Notes) -> Tuple[int, int]:
-    _uid = uid(update)
+async def teapot_time(
+    uid: str, data: Union[Notes, projection.Snapshot]
+) -> Tuple[int, int]:
+    user = await adb.user_settings(uid)
     coin_sec = (data.teapot_max - data.teapot) / data.teapot_seconds
-    seconds = (db.teapot_max(_uid) - db.teapot(_uid)) // coin_sec
+    seconds = (user.teapot_max - user.teapot) // coin_sec
     return data.teapot, seconds
 
 
-async def notify_teapot(context: Context) -> None:
-    update = context.job.data
-    msg, notes_data = await notes(uid(update))
+async def teapot_due(
+    uid: str, data: Union[Notes, projection.Snapshot]
+) -> bool:
+    if not data.teapot_seconds:
+        return True
+    _, warn_seconds = await teapot_time(uid, data)
+    return data.teapot_seconds <= warn_seconds
+
+
+async def notify_teapot(target: Target) -> None:
+    fetched, notes_data = await confirmed(str(target.chat), teapot_due)
     if not notes_data.teapot_seconds:
-        await send(
-            update,
+        await send_bot(
+            BOT,
+            target.chat,
             "‼ Hey, your teapot currency has reached the cap!",
-            button=True,
         )
     else:
-        teapot, warn_seconds = teapot_time(update, notes_data)
+        teapot, warn_seconds = await teapot_time(str(target.chat), notes_data)
         if notes_data.teapot_seconds <= warn_seconds:
-            await send(
-                update,
+            await send_bot(
+                BOT,
+                target.chat,
                 f"⚠️ Hey, your teapot currency is over {teapot}!",
-                button=True,
             )
-        notifier_teapot(update, context, notes_data)
-    await gui.update_notes(update, context, (msg, notes_data))
+        await notifier_teapot(target, notes_data)
+    if fetched is not None:
+        await gui.update_notes(target, fetched)
 
 
-def notifier_teapot(update: Update, context: Context, data: Notes) -> None:
-    queue = context.job_queue
-    _remove_job(queue, f"teapot_{uid(update)}")
-    if db.teapot_warn(uid(update)) == 1:
+async def notifier_teapot(
+    target: Target, data: Union[Notes, projection.Snapshot]
+) -> None:
+    _uid = str(target.chat)
+    unschedule(_uid, "teapot")
+    if await adb.teapot_warn(_uid) == 1:
         if data.teapot_seconds:
-            _, warn_seconds = teapot_time(update, data)
+            _, warn_seconds = await teapot_time(_uid, data)
             warn = data.teapot_seconds - warn_seconds
             if warn <= 0:
                 warn = data.teapot_seconds
-            queue.run_once(
-                notify_teapot, warn, name=f"teapot_{uid(update)}", data=update
-            )
+            schedule(target, "teapot", warn)
 
 
-async def notify_parametric(context: Context) -> None:
-    update = context.job.data
-    await send(
-        update, "‼ Hey, your parametric is out of cooldown!", button=True
+async def notify_parametric(target: Target) -> None:
+    await send_bot(
+        BOT, target.chat, "‼ Hey, your parametric is out of cooldown!"
     )
 
 
-def notifier_parametric(
-    update: Update, context: Context, parametric: TimeDelta
-) -> None:
-    queue = context.job_queue
+async def notifier_parametric(target: Target, parametric: TimeDelta) -> None:
+    _uid = str(target.chat)
     if parametric is not None:
-        if db.parametric_warn(uid(update)) == 1:
+        if await adb.parametric_warn(_uid) == 1:
             noti = False
-            if not queue.get_jobs_by_name(f"parametric_{uid(update)}"):
+            if not SCHEDULER.scheduled(_uid, "parametric"):
                 if parametric.days:
                     parametric = TimeDelta(days=parametric.days + 1)
                     noti = True
                 if noti or parametric.seconds:
-                    queue.run_once(
-                        notify_parametric,
-                        parametric,
-                        name=f"parametric_{uid(update)}",
-                        data=update,
-                    )
-
-
-async def notify_expedition(context: Context) -> None:
-    update = context.job.data
-    await send(
-        update, "‼ Hey, all your expeditions have finished!", button=True
+                    schedule(target, "parametric", parametric.total_seconds())
+
+
+async def notify_expedition(target: Target) -> None:
+    await send_bot(
+        BOT, target.chat, "‼ Hey, all your expeditions have finished!"
     )
 
 
-def notifier_expedition(
-    update: Update, context: Context, expedition: TimeDelta
-) -> None:
-    queue = context.job_queue
-    _remove_job(queue, f"expedition_{uid(update)}")
-    if db.expedition_warn(uid(update)) == 1:
+async def notifier_expedition(target: Target, expedition: TimeDelta) -> None:
+    _uid = str(target.chat)
+    unschedule(_uid, "expedition")
+    if await adb.expedition_warn(_uid) == 1:
         if expedition.seconds:
-            queue.run_once(
-                notify_expedition,
-                expedition,
-                name=f"expedition_{uid(update)}",
-                data=update,
-            )
+            schedule(target, "expedition", expedition.total_seconds())
 
 
-def last_updated() -> str:
-    return datetime.datetime.now(pytz.timezone(setting("timezone"))).strftime(
-        "%Y/%m/%d %H:%M:%S"
-    )
+NOTIFY = {
+    "autoupdate_notes": update_notes,
+    "resin": notify_resin,
+    "teapot": notify_teapot,
+    "parametric": notify_parametric,
+    "expedition": notify_expedition,
+}
 
 
 async def redeem(uid: str, code: str) -> str:
-    try:
-        await CLIENT[uid].redeem_code(code)
-    except genshin.errors.RedemptionException as e:
-        msg = e.msg
-    except genshin.errors.InvalidCookies:
+    for retry in (False, True):
         try:
-            stoken = account(uid, "stoken")
-        except KeyError:
-            msg = "Invalid cookies. Check config file."
-        else:
-            if stoken:
-                ltuid = account(uid, "ltuid")
-                headers = {
-                    "x-rpc-app_version": "2.11.2",
-                    "User-Agent": (
-                        "Mozilla/5.0 (iPhone; CPU iPhone OS "
-                        "13_2_3 like Mac OS X) AppleWebKit/"
-                        "605.1.15 (KHTML, like Gecko) "
-                        "miHoYoBBS/2.11.1"
-                    ),
-                    "x-rpc-client_type": "5",
-                    "Referer": "https://webstatic.mihoyo.com/",
-                    "Origin": "https://webstatic.mihoyo.com",
-                    "Cookie": f"stuid={ltuid};stoken={stoken}",
-                }
-                params = {"uid": ltuid, "stoken": stoken}
-                try:
-                    async with aiohttp.ClientSession() as session:
-                        async with session.post(
-                            "https://api-account-os.hoyolab.com/"
-                            "account/auth/api/"
-                            "getCookieAccountInfoBySToken",
-                            params=params,
-                            headers=headers,
-                        ) as res:
-                            data = json.loads(await res.text())
-                            cookie_token = data["data"]["cookie_token"]
-                            CONFIG["accounts"][uid]["ctoken"] = cookie_token
-                            with open(CONF_FILE, "w") as f:
-                                json.dump(CONFIG, f, indent=2)
-                            del CLIENT[uid]
-                            CLIENT[uid] = genshin.Client(
-                                {
-                                    "ltoken": account(uid, "ltoken"),
-                                    "ltuid": account(uid, "ltuid"),
-                                    "account_id": account(uid, "ltuid"),
-                                    "cookie_token": cookie_token,
-                                }
-                            )
-                            CLIENT[uid].default_game = "genshin"
-                            msg = await redeem(uid, code)
-                except aiohttp.web.HTTPException:
-                    msg = "Could not renew cookie_token using stoken."
+            await api(uid, "redeem_code", code, account(uid, "uid"))
+        except genshin.errors.RedemptionCooldown as e:
+            if retry:
+                msg = e.msg
             else:
-                msg = "Could not redeem cookie_token because stoken is empty."
-    else:
-        msg = "Code redeemed successfully."
-    return msg
-
-
-async def notes(uid: str) -> Tuple[str, Notes]:
-    data = await CLIENT[uid].get_genshin_notes(account(uid, "uid"))
-    data = Notes(data)
-    msg = (
-        f"<b>Resin:</b> "
-        f"<code>"
-        f"{data.resin}/{data.resin_max} ({data.resin_time})"
-        f"</code>\n"
-        f"<b>Teapot Currency:</b> "
-        f"<code>"
-        f"{data.teapot}/{data.teapot_max} ({data.teapot_time})"
-        f"</code>\n"
-        f"<b>Parametric Transformer:</b> "
-        f"<code>"
-        f"{data.parametric_time}"
-        f"</code>\n"
-        f"<b>Commissions:</b> "
-        f"<code>"
-        f"{data.commissions}/{data.commissions_max} "
-        f"({data.commissions_claimed})"
-        f"</code>\n"
-        f"<b>Weekly Boss Discounts:</b> "
-        f"<code>"
-        f"{data.weeklies}/{data.weeklies_max}"
-        f"</code>\n"
-        f"<b>Expeditions:</b>\n"
-        f"{fmt_exp_chars(data.expeditions)}\n"
-        f"<b>Last updated</b>: <code>{last_updated()}</code>"
+                await asyncio.sleep(
+                    setting("redeem_cooldown", REDEEM_COOLDOWN)
+                )
+                continue
+        except genshin.errors.RedemptionException as e:
+            msg = e.msg
+        except genshin.errors.InvalidCookies:
+            # api already tried to renew cookie_token with stoken
+            try:
+                stoken = account(uid, "stoken")
+            except KeyError:
+                msg = COOKIE_INVALID
+            else:
+                msg = COOKIE_RENEW if stoken else COOKIE_EMPTY
+        else:
+            msg = render.REDEEMED
+        return msg
+
+
+async def redeem_many(
+    uids: List[str], codes: List[str]
+) -> Dict[str, Dict[str, str]]:
+    # accounts run concurrently, codes of one account wait out the cooldown
+    limit = asyncio.Semaphore(setting("concurrency", CONCURRENCY))
+    cooldown = setting("redeem_cooldown", REDEEM_COOLDOWN)
+
+    async def _account(uid: str) -> Dict[str, str]:
+        results = {}
+        async with limit:
+            for idx, code in enumerate(codes):
+                if idx:
+                    await asyncio.sleep(cooldown)
+                results[code] = msg = await redeem(uid, code)
+                if msg in (COOKIE_INVALID, COOKIE_RENEW, COOKIE_EMPTY):
+                    # the remaining codes would fail the same way
+                    results.update(dict.fromkeys(codes[idx:], msg))
+                    break
+        return results
+
+    gathered = await asyncio.gather(
+        *(_account(uid) for uid in uids), return_exceptions=True
     )
+    results = {code: {} for code in codes}
+    for uid, res in zip(uids, gathered):
+        if isinstance(res, Exception):
+            logging.error(f"Could not redeem codes for {uid}: {res!r}")
+            res = dict.fromkeys(codes, "Unexpected error.")
+        for code in codes:
+            results[code][uid] = res[code]
+    return results
+
+
+async def notes(uid: str, force: bool = False) -> Tuple[str, Notes]:
+    now = time.monotonic()
+    entry = _NOTES.get(uid)
+    if entry is not None:
+        fetched, task = entry
+        fresh = now - fetched < setting("notes_ttl", NOTES_TTL)
+        if not task.done() or (fresh and not force):
+            return await asyncio.shield(task)
+    task = asyncio.ensure_future(_notes(uid))
+    _NOTES[uid] = (now, task)
+
+    def _discard(task: asyncio.Future) -> None:
+        if task.cancelled() or task.exception() is not None:
+            if _NOTES.get(uid, (None, None))[1] is task:
+                del _NOTES[uid]
+
+    task.add_done_callback(_discard)
+    return await asyncio.shield(task)
+
+
+async def _notes(uid: str) -> Tuple[str, Notes]:
+    data = await api(uid, "get_genshin_notes", account(uid, "uid"))
+    data = Notes(data)
+    projection.update(uid, data)
+    msg = render.notes(data, setting("timezone"))
     return (msg, data)
 
 
-def fmt_exp_chars(characters: ExpChars) -> str:
-    exp = [
-        f"    - Character {idx} => "
-        f"<code>"
-        f"{chr.remaining_time if not chr.finished else 'Finished'}"
-        f"</code>\n"
-        for idx, chr in enumerate(characters, 1)
-    ]
-    return "".join(exp)
+async def diary_data(uid: str, month: int) -> dict:
+    now = server_now()
+    # months after the current one are from last year
+    year = now.year if month <= now.month else now.year - 1
+    final = int((year, month) < (now.year, now.month))
+    cached = await adb.diary(uid, year, month)
+    if cached is not None:
+        data, cached_final, updated = cached
+        fresh = time.time() - updated < setting("diary_ttl", DIARY_TTL)
+        # months are immutable once they have been fetched after ending
+        if cached_final or (not final and fresh):
+            return json.loads(data)
+    info = await api(uid, "get_diary", month=month)
+    data = {
+        "primogems": info.data.current_primogems,
+        "categories": [
+            [category.name, category.amount, category.percentage]
+            for category in info.data.categories
+        ],
+    }
+    await adb.set_diary(uid, year, month, json.dumps(data), final, time.time())
+    return data
 
 
 async def diary(uid: str, month: int) -> str:
-    info = await CLIENT[uid].get_diary(month=month)
-    msg = [
-        f"<b>Primogems earned in {calendar.month_name[month]}</b>: "
-        f"<code>{info.data.current_primogems}</code>"
-    ]
-    for category in info.data.categories:
-        msg.append(
-            f"    - {category.name}: "
-            f"<code>{category.amount} "
-            f"({category.percentage} %)</code>"
-        )
-    return "\n".join(msg)
+    return render.diary(month, await diary_data(uid, month))
 
 
-async def abyss(uid: str, previous: bool = False, floor: str = "all") -> str:
-    data = await CLIENT[uid].get_spiral_abyss(
-        account(uid, "uid"), previous=previous
-    )
-    sea = "Current"
+def _abyss_expiry(data: Abyss, previous: bool) -> float:
+    now = time.time()
+    ttl = setting("abyss_ttl", ABYSS_TTL)
     if previous:
-        sea = "Previous"
-
-    msg = (
-        f"⚜ <b>{sea} Season</b> ⚜\n\n"
-        f"<b>Summary</b>:\n"
-        f"    - <b>Deepest Descent:</b> "
-        f"<code>"
-        f"{data.max_floor}"
-        f"</code>\n"
-        f"    - <b>Battles Fought:</b> "
-        f"<code>"
-        f"{data.total_battles} ({data.total_stars} ⭐️)"
-        f"</code>\n\n"
-        f"{fmt_stats(data.ranks)}"
-        f"{fmt_floors(data.floors, floor)}"
-    )
-    return msg
-
-
-def _floor(floors: Floors, floor: str) -> Floors:
-    if floor in FLOORS:
-        return [fl for fl in floors if str(fl.floor) == floor]
-    else:
-        return [fl for fl in floors if str(fl.floor) in FLOORS]
-
-
-def fmt_floors(floors: Floors, floor: str) -> str:
-    data = _floor(floors, floor)
-    msg = ""
-    parsed = "\n".join(
-        [
-            "".join(
-                [
-                    (
-                        f"    - <b>{fl.floor} - {ch.chamber}</b>: "
-                        f"{ch.stars}/{ch.max_stars} ⭐️\n"
-                        f"{fmt_battle_chars(ch.battles)}\n"
-                    )
-                    for ch in fl.chambers
-                ]
-            )
-            for fl in data
-        ]
-    )
-    if parsed:
-        msg = f"<b>Floors:</b>\n{parsed}"
-    return msg
-
-
-def fmt_battle_chars(battles: Battles) -> str:
-    msg = []
-    for battle in battles:
-        half = [char.name for char in battle.characters]
-        msg.append(f"    » <code>{', '.join(half)}</code>")
-    return "\n".join(msg)
-
-
-def fmt_stats(stats: Stats) -> str:
-    chars = sum([len(getattr(stats, category)) for category in stats.dict()])
-    msg = ""
-    if chars:
-        msg = (
-            f"<b>Stats</b>:\n"
-            f"    - <b>Most played</b>:\n"
-            f"{fmt_stat_chars(stats.most_played)}\n"
-            f"    - <b>Most kills</b>:\n"
-            f"{fmt_stat_chars(stats.most_kills)}\n"
-            f"    - <b>Strongest strike</b>:\n"
-            f"{fmt_stat_chars(stats.strongest_strike)}\n"
-            f"    - <b>Most damage taken</b>:\n"
-            f"{fmt_stat_chars(stats.most_damage_taken)}\n"
-            f"    - <b>Most bursts used</b>:\n"
-            f"{fmt_stat_chars(stats.most_bursts_used)}\n"
-            f"    - <b>Most skills used</b>:\n"
-            f"{fmt_stat_chars(stats.most_skills_used)}\n\n"
+        # previous season rolls over when the current one ends
+        season = data.end_time - data.start_time
+        return max((data.end_time + season).timestamp(), now + ttl)
+    return min(now + ttl, max(data.end_time.timestamp(), now))
+
+
+async def abyss_data(
+    uid: str, previous: bool, force: bool = False
+) -> Tuple[Abyss, render.AbyssView]:
+    key = (uid, previous)
+    entry = _ABYSS.get(key)
+    if force or entry is None or time.time() >= entry[0]:
+        data = await api(
+            uid, "get_spiral_abyss", account(uid, "uid"), previous=previous
+        )
+        entry = _ABYSS[key] = (
+            _abyss_expiry(data, previous),
+            data,
+            render.AbyssView(data, previous),
         )
-    return msg
+    return entry[1], entry[2]
 
 
-def fmt_stat_chars(characters: StatChars) -> str:
-    msg = []
-    for ch in characters:
-        msg.append(f"    » <code>{ch.name} ({ch.value})</code>")
-    return "\n".join(msg)
+async def abyss(
+    uid: str, previous: bool = False, floor: str = "all", force: bool = False
+) -> str:
+    _, view = await abyss_data(uid, previous, force)
+    return view.render(floor)